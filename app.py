@@ -1,19 +1,156 @@
-from flask import Flask, render_template, Response, request
-from flask_socketio import SocketIO, emit
+import os
+
+# 映像の取得元: 'local': このプロセスでカメラをキャプチャ, 'shm': capture_daemon.py の共有メモリリングから読む
+CAPTURE_SOURCE = os.environ.get('CAPTURE_SOURCE', 'local')
+
+# 非同期モード: 'threading'（既定、サポート対象）または 'gevent'（実験的）
+# geventは代替モジュール（benchmarks/fakehw、pigpioはループバックのソケットで模擬）でしか確認しておらず、
+# 実機のpigpiod・Picamera2との組み合わせは未検証のため、運用では使わない
+# geventでは配信クライアントやSocket.IOクライアントがOSスレッドではなくグリーンレットになる
+# （他のモジュールより先に標準ライブラリを置き換える必要があるため、ここで判定する）
+# Picamera2は内部で独自のスレッドを使い、モンキーパッチした同じプロセスでの動作は確認できていないため、
+# geventはカメラを capture_daemon.py の別プロセスに任せる構成（CAPTURE_SOURCE=shm）でのみ使う
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'gevent' and CAPTURE_SOURCE != 'shm':
+    print("ASYNC_MODE=gevent は CAPTURE_SOURCE=shm の場合のみ使えます（threadingモードで起動します）")
+    ASYNC_MODE = 'threading'
+if ASYNC_MODE == 'gevent':
+    print("ASYNC_MODE=gevent は実験的なモードです（実機のpigpiod・Picamera2では未検証）")
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, render_template, Response, request, jsonify
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import pigpio
 import time
 import threading
 from rpi_ws281x import PixelStrip, Color
-import io
-import cv2
-from picamera2 import Picamera2
-from libcamera import Transform
 from threading import Condition
-import re
+import math
+import socket
+import itertools
+import functools
+import heapq
+import bisect
+import queue
+import shutil
+import struct
+from collections import OrderedDict, deque
+from frame_ring import FrameRing, ring_name
+from frame_buffers import EncodedFrame, FramePool
+from metrics import Registry, RateGauge, TimedLock
+from event_log import EventLogger
+from command_trace import CommandTrace
+from vision import VisionStage, ColorBlobTracker
+from capture_pipeline import (
+    CAMERA_RESOLUTION, JPEG_QUALITY, ENCODE_WORKERS, CAMERA_IDLE_STOP, CHANGE_DETECTION,
+    CHANGE_KEYFRAME_INTERVAL, STREAM_PROFILES, FrameEncoder, ChangeDetector, open_camera, capture_frame
+)
+
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 5000))
+
+# 起動からの経過時間の基準（サブシステムの初期化完了・最初のコマンドまでの時間を計測する）
+boot_started = time.monotonic()
+first_command_seconds = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
+
+# 同期的にブロックする処理（エンコード、Picamera2、PixelStrip.show）を実行するOSスレッドの上限
+# pigpioはPythonのソケットで通信するため、geventではそのまま協調的に動く
+BLOCKING_WORKERS = (os.cpu_count() or 1) + 2
+if ASYNC_MODE == 'gevent':
+    from gevent.threadpool import ThreadPool
+    blocking_pool = ThreadPool(BLOCKING_WORKERS)
+    
+    def run_blocking(function, *args):
+        """OSスレッドで実行し、呼び出し元のグリーンレットだけを待たせる"""
+        return blocking_pool.apply(function, args)
+else:
+    def run_blocking(function, *args):
+        """スレッドモードでは呼び出したスレッドでそのまま実行する"""
+        return function(*args)
+
+# ログ（Socket.IOハンドラーなど頻繁に通る経路はキュー経由で書き込み、標準出力を待たない）
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')     # DEBUG / INFO / WARNING / ERROR
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')   # 'text' または 'json'
+# イベントごとの出力制限 sample: N件に1件, rate: 1秒あたりの最大件数（間引いた件数はsuppressedで出力）
+LOG_RULES = {
+    'motor_control': {'rate': 10},
+    'servo_control': {'rate': 10},
+    'servo_angle': {'rate': 2},   # スライダー操作で大量に届く
+    'led_control': {'rate': 10},
+    'pigpio_unavailable': {'rate': 0.2},
+    'neopixel_unavailable': {'rate': 0.2},
+    'vision_overrun': {'rate': 1},
+    # 更新ループ・スケジューラーの例外（pigpiodが落ちると周期ごとに発生する）
+    'actuator_error': {'rate': 1},
+    'led_render_error': {'rate': 1},
+    'scheduler_error': {'rate': 1},
+    'deadman': {'rate': 5},
+}
+event_log = EventLogger(LOG_LEVEL, LOG_RULES, style=LOG_FORMAT)
+
+# メトリクス（/metrics でPrometheusテキスト形式、METRICS=0 で計測ごと無効）
+METRICS_ENABLED = os.environ.get('METRICS', '1') != '0'
+metrics = Registry('rpicontest_', enabled=METRICS_ENABLED)
+frames_captured = metrics.counter('frames_captured_total', 'カメラからキャプチャしたフレーム数')
+capture_fps = RateGauge(metrics.gauge('capture_fps', '直近1秒のキャプチャフレームレート'))
+frames_published = metrics.counter('frames_published_total', 'レンディションごとに配信したフレーム数')
+encoder_dropped = metrics.counter('encoder_frames_dropped_total', 'エンコードワーカーが埋まっていて破棄したフレーム数')
+imencode_seconds = metrics.histogram('imencode_seconds', 'cv2.imencodeの所要時間（秒）',
+                                     (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1))
+encoded_frame_bytes = metrics.histogram('encoded_frame_bytes', 'エンコード済みJPEGのサイズ（バイト）',
+                                        (4096, 8192, 16384, 32768, 65536, 131072, 262144))
+stream_client_lag = metrics.gauge('stream_client_lag_seconds', '/video_feedクライアントのキャプチャから送信完了までの時間（秒）')
+stream_client_dropped = metrics.counter('stream_client_frames_dropped_total', 'クライアントが受け取らずに飛ばしたフレーム数')
+socketio_events = metrics.counter('socketio_events_total', 'Socket.IOイベントの受信数')
+command_actuation_seconds = metrics.histogram('command_actuation_seconds',
+                                              'コマンド受信からpigpio・strip.show()呼び出しまでの時間（秒）',
+                                              (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5))
+commands_coalesced = metrics.counter('commands_coalesced_total', '反映される前に新しいコマンドで置き換えられたコマンド数')
+commands_discarded = metrics.counter('commands_discarded_total', '反映が不要だった（目標値が同じ・不正な）コマンド数')
+vision_processing_seconds = metrics.histogram('vision_processing_seconds', 'フレームプロセッサー1回の処理時間（秒）',
+                                              (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1))
+vision_overruns = metrics.counter('vision_overruns_total', 'フレームプロセッサーが処理時間の目安を超えた回数')
+startup_seconds = metrics.gauge('startup_seconds', '起動から各段階（サブシステムの初期化完了・サーバー開始・最初のコマンド）までの秒数')
+sequence_step_error_seconds = metrics.histogram('sequence_step_error_seconds',
+                                                'シーケンスのキーフレームを予定時刻から遅れて実行した時間（秒）',
+                                                (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05))
+frame_lock_wait_seconds = metrics.histogram('frame_lock_wait_seconds', 'frame_lockの取得待ち時間（秒）',
+                                            (0.00001, 0.0001, 0.001, 0.01, 0.1))
+
+class CommandLatency:
+    """
+    コマンド受信からハードウェアへの反映までの時間を計測する
+    アクチュエータごとに未反映の最も古い受信時刻を持ち、反映した時点でヒストグラムに記録する
+    反映が不要だった場合（目標値が変わらない等）は記録せずに捨てる
+    """
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._pending = {}  # アクチュエータ名 -> 受信時刻（time.perf_counter()）
+
+    def received(self, actuator):
+        """コマンドを受信した"""
+        if metrics.enabled:
+            if actuator in self._pending:
+                commands_coalesced.inc(actuator=actuator)
+            else:
+                self._pending[actuator] = time.perf_counter()
+
+    def actuated(self, actuator):
+        """ハードウェアに反映した"""
+        received_at = self._pending.pop(actuator, None)
+        if received_at is not None:
+            self._histogram.observe(time.perf_counter() - received_at, actuator=actuator)
+
+    def discard(self, actuator):
+        """反映が不要だった"""
+        if self._pending.pop(actuator, None) is not None:
+            commands_discarded.inc(actuator=actuator)
+
+command_latency = CommandLatency(command_actuation_seconds)
 
 # ### ピンの設定 ###
 # モーターA (左側) のピン
@@ -26,6 +163,31 @@ ENB = 9   # Enable B (PWM)
 IN3 = 7   # Input 3
 IN4 = 8   # Input 4
 
+MOTOR_IN_PINS = (IN1, IN2, IN3, IN4)
+MOTOR_IN_MASK = sum(1 << pin for pin in MOTOR_IN_PINS)
+
+# 方向ごとのIN1-IN4の出力 (IN1, IN2, IN3, IN4)
+MOTOR_DIRECTION_LEVELS = {
+    1: (0, 1, 1, 0),   # 前進
+    -1: (1, 0, 0, 1),  # 後進
+    2: (1, 0, 1, 0),   # 右旋回
+    -2: (0, 1, 0, 1),  # 左旋回
+    0: (0, 0, 0, 0),   # 停止
+}
+# 方向ごとにHIGHにするピンのビットマスク（バンク1への一括書き込み用）
+MOTOR_DIRECTION_BITS = {
+    direction: sum(1 << pin for pin, level in zip(MOTOR_IN_PINS, levels) if level)
+    for direction, levels in MOTOR_DIRECTION_LEVELS.items()
+}
+MOTOR_COMMANDS = {'forward': 1, 'backward': -1, 'left': -2, 'right': 2}  # motor_controlのaction -> 方向
+MOTOR_ACTIONS = {1: '前進', -1: '後進', 2: '右旋回', -2: '左旋回', 0: '停止'}
+
+# モーターピンの書き込み方式
+# 'script': pigpioスクリプトで1回の往復, 'bank': バンク一括書き込み, 'single': 1ピンずつ
+MOTOR_BATCH_MODE = 'script'
+# p0: LOWにするビット, p1: HIGHにするビット, p2: ENA, p3: デューティ, p4: ENB
+MOTOR_SCRIPT = 'bc1 p0 bs1 p1 pwm p2 p3 pwm p4 p3'
+
 # サーボモーター のピン
 SERVO_PITCH = 18  # ピッチ制御（上下）
 SERVO_YAW = 13    # ヨー制御（左右）
@@ -39,11 +201,20 @@ LED_BRIGHTNESS = 255 # 明度 (0-255)
 LED_INVERT = False   # 信号反転
 LED_CHANNEL = 0      # GPIOチャンネル
 
+# テレメトリ配信の設定
+TELEMETRY_RATE_HZ = 10          # 変更をまとめて配信する周期（Hz）
+# 配信先のルーム（既定のNoneでは全クライアントに配信、TELEMETRY_ROOM=telemetry などで
+# telemetry_subscribeで参加したクライアントだけに配信する）
+TELEMETRY_ROOM = os.environ.get('TELEMETRY_ROOM') or None
+
 # pigpioクライアントの初期化
 pi = None
 current_speed = 0
 current_direction = 0
-move_timer = None
+DEADMAN_TIMEOUT = 1.0  # 走行中のクライアントからハートビートが途絶えて自動停止するまでの秒数（0で無効）
+motor_script_id = None
+# モーターピンの書き込みコマンドのpigpioソケット往復時間（方式ごと、get_statusのmotor_command_rtt）
+motor_command_rtt_stats = {'mode': None, 'count': 0, 'last_ms': 0.0, 'avg_ms': 0.0, 'max_ms': 0.0}
 
 # サーボモーターの状態
 current_pitch = 90   # 初期角度（中央）
@@ -51,24 +222,331 @@ current_yaw = 90     # 初期角度（中央）
 servo_min_pulse = 500   # 最小パルス幅（μs）
 servo_max_pulse = 2500  # 最大パルス幅（μs）
 
+# アクチュエータ更新ループの周期（Hz）
+ACTUATOR_RATE_HZ = 50
+
+# 起動（各サブシステムを並行して初期化し、失敗したものはバックグラウンドで再試行する）
+SUBSYSTEM_RETRY_INTERVAL = 2.0       # 初期化に失敗してから再試行するまでの秒数（失敗が続くと倍にする）
+SUBSYSTEM_RETRY_MAX_INTERVAL = 30.0  # 再試行間隔の上限（秒）
+SUBSYSTEM_CHECK_INTERVAL = 5.0       # 初期化済みのサブシステムの状態を確認する間隔（秒）
+CONTROL_READY_TIMEOUT = 10.0         # 制御経路（pigpio）の初期化をサーバー開始前に待つ上限（秒、超えたら縮退状態で開始）
+# 映像配信専用のプロセス（CAPTURE_SOURCE=shm で2つ目以降のapp.pyを起動する場合に VIDEO_ONLY=1）
+# pigpio・NeoPixelの初期化と制御用のワーカーを行わず、制御コマンドはエラーを返す
+# （ハードウェアと制御の状態を持つのは1つの制御サーバーだけにする）
+VIDEO_ONLY = os.environ.get('VIDEO_ONLY', '0') == '1'
+CONTROL_EVENTS = ('motor_control', 'heartbeat', 'servo_control', 'servo_angle', 'led_control',
+                  'sequence_control', 'trace_control')
+
+# キーフレームシーケンス（sequence_control イベントでまとめて送り、ロボット側の時計で実行する）
+SEQUENCE_MAX_STEPS = 512           # 1シーケンスのキーフレーム数の上限
+SEQUENCE_MAX_DURATION = 600.0      # 最後のキーフレームの時刻の上限（秒）
+
+# サーボの動作制限（目標角度まではこの範囲で滑らかに補間する）
+SERVO_MAX_VELOCITY = 180.0      # 最大角速度（度/秒）
+SERVO_MAX_ACCELERATION = 720.0  # 最大角加速度（度/秒^2）
+
 # NeoPixel LEDの初期化
 strip = None
 led_brightness = 100  # 初期明度 (0-100%)
-led_animation_timer = None
+LED_FRAME_RATE = 50   # LEDアニメーションのフレームレート (Hz)
+
+# レインボーの色テーブル（元の計算式 sin(index * 0.024 + 位相) を事前計算）
+LED_RAINBOW_TABLE = [
+    (int((math.sin(index * 0.024) + 1) * 127),
+     int((math.sin(index * 0.024 + 2) + 1) * 127),
+     int((math.sin(index * 0.024 + 4) + 1) * 127))
+    for index in range(512)
+]
+LED_RAINBOW_OFFSETS = [i * 256 // LED_COUNT for i in range(LED_COUNT)]
+# 明度テーブル: LED_BRIGHTNESS_TABLE[明度%][値] = 明度適用後の値
+LED_BRIGHTNESS_TABLE = [bytes(value * brightness // 100 for value in range(256))
+                        for brightness in range(101)]
 
-# カメラの設定
+# カメラの設定（解像度・JPEG品質・変化検出・レンディションは capture_pipeline.py）
 camera = None
-output_frame = None
-frame_lock = threading.Lock()
+camera_running = False
+stream_active = False    # キャプチャ・エンコードが動作中かどうか
+# フレーム解析（vision_control で有効化、有効な間は視聴者がいなくてもキャプチャを続ける）
+# 共有メモリから読む場合（CAPTURE_SOURCE='shm'）はキャプチャ前のフレームがないため動作しない
+VISION_SCALE = 4                 # 縦横をこの間隔で間引いた縮小コピーを解析する
+VISION_ROOM = 'vision'           # 解析結果の配信先ルーム（vision_subscribeで参加）
+BLOB_TRACKER_EVERY = 3           # 色追跡をN枚に1枚だけ行う
+BLOB_TRACKER_BUDGET = 0.01       # 色追跡1回の処理時間の目安（秒）
+AIM_GAIN = (15.0, 20.0)          # 自動照準: 画面端までのずれ1.0あたりに動かす角度（ピッチ, ヨー、向きが逆なら負にする）
+AIM_DEADBAND = 0.05              # 自動照準: 中央からのずれがこれ以下なら動かさない
+FRAME_RING_POLL_INTERVAL = 0.005  # 共有メモリリングを確認する間隔（秒）
+FRAME_RING_STALE_TIMEOUT = 2.0    # 書き込み側の更新がこの秒数途絶えたらリングに接続し直す
+frame_lock = TimedLock(threading.RLock(), frame_lock_wait_seconds)
+viewers_changed = Condition(frame_lock)  # 視聴者数の変化をキャプチャスレッドに通知
+
+# 配信レンディション（/video_feed?profile=名前 で選択、STREAM_PROFILESは capture_pipeline.py）
+DEFAULT_STREAM_PROFILE = 'full'
+STREAM_SNDBUF = 64 * 1024  # /video_feed ソケットの送信バッファ上限（バイト、0で変更しない）
+send_buffer_unavailable_reported = False
+SOCKET_VIDEO_WINDOW = 2         # Socket.IO映像でack待ちを許すフレーム数
+SOCKET_VIDEO_MAX_WINDOW = 16    # video_subscribeで指定できるwindowの上限
+SOCKET_VIDEO_ACK_TIMEOUT = 2.0  # ackが返らないフレームを失ったとみなすまでの秒数
+
+# 録画の設定（recording_control イベントで開始・停止）
+RECORDING_DIR = os.environ.get('RECORDING_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings'))
+RECORDING_PROFILE = 'full'                  # 録画するレンディション
+RECORDING_SEGMENT_SECONDS = 60              # 1セグメントの長さ（秒）
+RECORDING_QUOTA_BYTES = 2 * 1024 ** 3       # 録画全体の上限（超える分は古いセグメントから削除）
+RECORDING_MIN_FREE_BYTES = 256 * 1024 ** 2  # ディスクの空きがこれを下回らないよう古いセグメントを削除
+RECORDING_QUEUE_SIZE = 60                   # 書き込み待ちフレーム数の上限（溢れたフレームは破棄）
+RECORDING_INDEX = struct.Struct('<dQI')     # インデックス1件: キャプチャ時刻, オフセット, 長さ
+
+# 制御コマンドのトレース記録（trace_control イベントで開始・停止、COMMAND_TRACE=1 で起動時から記録）
+# benchmarks/replay_trace.py で記録したトレースをサーバーに再送できる
+TRACE_DIR = os.environ.get('TRACE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traces'))
+TRACE_AT_STARTUP = os.environ.get('COMMAND_TRACE', '0') == '1'
+TRACE_EVENTS = ('motor_control', 'servo_control', 'servo_angle', 'led_control')
+
+# タイムシフト（直近のフレームをメモリに保持し /replay で巻き戻して再生）
+# 有効な間はTIMESHIFT_PROFILEのレンディションを視聴者がいなくてもエンコードし続け、
+# 視聴者がいない間のキャプチャ・エンコードの休止が効かなくなるため既定では無効（TIMESHIFT_SECONDS=30 などで有効）
+TIMESHIFT_SECONDS = int(os.environ.get('TIMESHIFT_SECONDS', 0))
+TIMESHIFT_PROFILE = 'half'
+TIMESHIFT_MAX_BYTES = 64 * 1024 ** 2  # 保持するフレームの合計サイズの上限
+REPLAY_MAX_SPEED = 16.0
+# /snapshot.jpg でこれより古いフレームしかなければ新しいフレームを待つ
+# （変化検出中は静止した場面でもCHANGE_KEYFRAME_INTERVALごとにしか更新されないため、それより長くする）
+SNAPSHOT_MAX_AGE = CHANGE_KEYFRAME_INTERVAL * 2
+SNAPSHOT_WAIT_TIMEOUT = 2.0
+
+class FrameBroker:
+    """
+    エンコード済みフレームの配信ブローカー
+    capture_framesが番号付きフレームを発行し、
+    購読者は自分が持つものより新しいフレームが届くまで待機する
+    """
+    def __init__(self, lock, viewers_changed=None):
+        self._condition = Condition(lock)
+        self._viewers_changed = viewers_changed
+        self._frame = None
+        self._sequence = 0
+        self._timestamp = 0.0
+        self._viewers = 0
+        self._listeners = []
+
+    def publish(self, frame, captured_at=None):
+        """
+        新しいフレームを発行し、待機中の購読者を起こす
+        captured_at: キャプチャ時刻（time.time()、省略時は発行時刻）
+        """
+        with self._condition:
+            self._frame = frame
+            self._sequence += 1
+            self._timestamp = captured_at if captured_at is not None else time.time()
+            self._condition.notify_all()
+            listeners = self._listeners
+            timestamp = self._timestamp
+        for listener in listeners:
+            listener(frame, timestamp)
+
+    def add_listener(self, listener):
+        """
+        発行されたフレームを全て受け取る関数 listener(frame, captured_at) を登録する
+        発行側のスレッドで呼ばれるため、listenerはブロックしてはならない
+        """
+        with self._condition:
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        """リスナーの登録を解除"""
+        with self._condition:
+            self._listeners = [l for l in self._listeners if l != listener]
+
+    def wait_for_frame(self, last_sequence, timeout=None):
+        """
+        last_sequenceより新しいフレームが届くまで待機する
+        途中のフレームは飛ばし、常に最新のものを返す
+        return: (シーケンス番号, フレーム, キャプチャ時刻)、タイムアウト時はフレームがNone
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._sequence > last_sequence, timeout):
+                return last_sequence, None, None
+            return self._sequence, self._frame, self._timestamp
+
+    def latest(self):
+        """最新のフレームを返す (シーケンス番号, フレーム, キャプチャ時刻)"""
+        with self._condition:
+            return self._sequence, self._frame, self._timestamp
+
+    def add_viewer(self):
+        """視聴者を登録し、待機中のキャプチャスレッドを起こす"""
+        with self._condition:
+            self._viewers += 1
+            if self._viewers_changed is not None:
+                self._viewers_changed.notify_all()
+
+    def remove_viewer(self):
+        """視聴者の登録を解除"""
+        with self._condition:
+            self._viewers = max(0, self._viewers - 1)
+
+    @property
+    def viewers(self):
+        """現在の視聴者数"""
+        with self._condition:
+            return self._viewers
+
+def record_encoding(encoder, encode_seconds, result):
+    """エンコード1枚分の計測（エンコードワーカーから呼ばれる）"""
+    imencode_seconds.observe(encode_seconds, rendition=encoder.name)
+    if result:
+        encoded_frame_bytes.observe(result.size, rendition=encoder.name)
+
+class StreamRendition:
+    """
+    名前付きの配信レンディション
+    視聴者がいる間だけ縮小・エンコードを行い、結果を同じレンディションの全視聴者で共有する
+    """
+    def __init__(self, name, scale=1.0, quality=JPEG_QUALITY):
+        self.name = name
+        self.scale = scale
+        self.quality = quality
+        self.broker = FrameBroker(frame_lock, viewers_changed)
+        self.encoder = FrameEncoder(self.broker.publish, quality=quality, scale=scale, name=name,
+                                    run=run_blocking, on_encoded=record_encoding)
+
+    def status(self):
+        """レンディションの設定と視聴者数"""
+        return {
+            'size': [int(CAMERA_RESOLUTION[0] * self.scale), int(CAMERA_RESOLUTION[1] * self.scale)],
+            'quality': self.quality,
+            'viewers': self.broker.viewers
+        }
+
+stream_renditions = {name: StreamRendition(name, **profile)
+                     for name, profile in STREAM_PROFILES.items()}
+
+change_detector = ChangeDetector() if CHANGE_DETECTION else None
+
+def publish_vision_result(processor, result, captured_at, seconds):
+    """フレームプロセッサーの結果を配信する（ワーカースレッドから呼ばれる）"""
+    vision_processing_seconds.observe(seconds, processor=processor.name)
+    if result is not None:
+        socketio.emit('vision', {'processor': processor.name, 'captured_at': captured_at,
+                                 'seconds': round(seconds, 6), 'result': result}, to=VISION_ROOM)
+
+def report_vision_overrun(processor, seconds):
+    """処理時間の目安を超えたことを記録・通知する"""
+    vision_overruns.inc(processor=processor.name)
+    event_log.warning('vision_overrun', 'フレーム解析が処理時間の目安を超えました', processor=processor.name,
+                      ms=round(seconds * 1000, 3), budget_ms=round(processor.budget * 1000, 3))
+    socketio.emit('vision_overrun', {'processor': processor.name, 'seconds': round(seconds, 6),
+                                     'budget': processor.budget}, to=VISION_ROOM)
+
+def aim_at(x, y):
+    """画面上の位置 (x, y)（中央が0、端が±1）が中央に来るようにサーボの目標角度を動かす"""
+    global current_pitch, current_yaw
+    pitch_gain, yaw_gain = AIM_GAIN
+    # 画面の上（y<0）はピッチを上げる方向、左（x<0）はヨーを増やす方向
+    if abs(y) > AIM_DEADBAND:
+        current_pitch = max(0, min(180, pitch_axis.status()['current'] - y * pitch_gain))
+        pitch_axis.set_target(current_pitch, 'vision')
+    if abs(x) > AIM_DEADBAND:
+        current_yaw = max(0, min(180, yaw_axis.status()['current'] - x * yaw_gain))
+        yaw_axis.set_target(current_yaw, 'vision')
+
+vision_stage = VisionStage(VISION_SCALE, on_result=publish_vision_result, on_overrun=report_vision_overrun,
+                           run=run_blocking)
+vision_stage.add(ColorBlobTracker(every=BLOB_TRACKER_EVERY, budget=BLOB_TRACKER_BUDGET,
+                                  enabled=False, on_target=aim_at))
+
+# キャプチャ先の配列プール（全エンコーダーの同時処理数 + キャプチャ中の1枚で足りる）
+capture_pool = FramePool((CAMERA_RESOLUTION[1], CAMERA_RESOLUTION[0], 3),
+                         limit=ENCODE_WORKERS * len(STREAM_PROFILES) + 1)
+
+def wait_for_viewers(timeout=None, renditions=None):
+    """
+    いずれかのレンディションに視聴者が現れるまで待機する（タイムアウト時はFalse）
+    renditions: 対象のレンディション（省略時は全て）
+    """
+    renditions = renditions or list(stream_renditions.values())
+    with viewers_changed:
+        return viewers_changed.wait_for(
+            lambda: any(r.broker.viewers > 0 for r in renditions), timeout)
+
+class TelemetryStore:
+    """
+    ロボットの状態を1か所にまとめるストア
+    各処理はupdateで状態を書き込むだけで、変更されたキーは差分として溜まり、
+    テレメトリ配信スレッドがTELEMETRY_RATE_HZ周期でまとめて送信する
+    """
+    def __init__(self, initial):
+        self._condition = Condition()
+        self._state = dict(initial)
+        self._delta = {}
+
+    def update(self, **fields):
+        """状態を更新し、値が変わったキーだけを差分に加える"""
+        with self._condition:
+            for key, value in fields.items():
+                if self._state.get(key) != value:
+                    self._state[key] = value
+                    self._delta[key] = value
+            if self._delta:
+                self._condition.notify()
+
+    def snapshot(self):
+        """全状態のコピー"""
+        with self._condition:
+            return dict(self._state)
+
+    def take_delta(self, timeout=None):
+        """溜まった差分を取り出す（差分がなければtimeoutまで待機、なければNone）"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._delta, timeout):
+                return None
+            delta, self._delta = self._delta, {}
+            return delta
+
+telemetry = TelemetryStore({
+    'action': '停止', 'speed': 0, 'direction': 0,
+    'connected': False,
+    'pitch': current_pitch, 'yaw': current_yaw,
+    'led_brightness': led_brightness,
+    'led_colors': ['#000000'] * LED_COUNT,
+    'led_animation': None,
+    'recording': False,
+    'health': {}
+})
+
+def telemetry_loop():
+    """状態の差分をTELEMETRY_RATE_HZ周期でまとめて配信するループ"""
+    interval = 1.0 / TELEMETRY_RATE_HZ
+    
+    while True:
+        delta = telemetry.take_delta()
+        try:
+            if TELEMETRY_ROOM:
+                socketio.emit('telemetry', delta, to=TELEMETRY_ROOM)
+            else:
+                socketio.emit('telemetry', delta)
+        except Exception as e:
+            print(f"テレメトリ配信エラー: {e}")
+        # 次の周期までに届いた変更は1つの差分にまとめる
+        time.sleep(interval)
 
 def init_pigpio():
     """pigpioを初期化"""
     global pi
+    if pi is not None:
+        # 切れた接続を閉じてから接続し直す（ソケットと通知スレッドを残さない）
+        try:
+            pi.stop()
+        except Exception:
+            pass
+        pi = None
     try:
-        pi = pigpio.pi()
-        if not pi.connected:
+        connection = pigpio.pi()
+        if not connection.connected:
             print("pigpioデーモンに接続できません")
             return False
+        pi = connection
         
         # 全てのピンを出力モードに設定
         pi.set_mode(ENA, pigpio.OUTPUT)
@@ -90,28 +568,56 @@ def init_pigpio():
         pi.set_PWM_dutycycle(ENA, 0)
         pi.set_PWM_dutycycle(ENB, 0)
         
+        # モーター制御スクリプトをアップロード
+        if MOTOR_BATCH_MODE == 'script':
+            load_motor_script()
+        
         # サーボモーターを中央位置に設定
         set_servo_angle(SERVO_PITCH, current_pitch)
         set_servo_angle(SERVO_YAW, current_yaw)
         
+        # 接続し直した場合、切断中に反映済みとみなしていた値も改めて書き込ませる
+        for mailbox in actuator_mailboxes:
+            mailbox.invalidate()
+        for axis in servo_axes.values():
+            axis.invalidate()
+        
+        telemetry.update(connected=True)
         print("pigpio初期化完了")
         return True
     except Exception as e:
         print(f"pigpio初期化エラー: {e}")
+        pi = None
         return False
 
+def load_motor_script():
+    """モーター制御用のpigpioスクリプトを登録（失敗時はバンク書き込みで代用）"""
+    global motor_script_id
+    try:
+        script_id = pi.store_script(MOTOR_SCRIPT.encode())
+        # スクリプトの準備ができるまで待機
+        while pi.script_status(script_id)[0] == pigpio.PI_SCRIPT_INITING:
+            time.sleep(0.01)
+        motor_script_id = script_id
+    except Exception as e:
+        print(f"モータースクリプト登録エラー（バンク書き込みを使用）: {e}")
+        motor_script_id = None
+
 def init_neopixel():
     """NeoPixel LEDを初期化"""
     global strip
     try:
-        strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
-        strip.begin()
+        new_strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
+        new_strip.begin()
         
         # 全てのLEDを消灯
         for i in range(LED_COUNT):
-            strip.setPixelColor(i, Color(0, 0, 0))
-        strip.show()
+            new_strip.setPixelColor(i, Color(0, 0, 0))
+        new_strip.show()
         
+        # 初期化が終わってからレンダースレッドに使わせる（現在の色は次のフレームで書き直す）
+        strip = new_strip
+        led_engine.reset()
         print("NeoPixel LED初期化完了")
         return True
     except Exception as e:
@@ -120,17 +626,12 @@ def init_neopixel():
 
 def init_camera():
     """カメラを初期化"""
-    global camera
+    global camera, camera_running
     try:
-        camera = Picamera2()
-        
-        # カメラ設定（上下左右反転）
-        config = camera.create_video_configuration(
-            main={"size": (640, 480), "format": "RGB888"},
-            transform=Transform(hflip=True, vflip=True)
-        )
-        camera.configure(config)
-        camera.start()
+        new_camera = open_camera()
+        # 起動が終わってからキャプチャスレッドに使わせる
+        camera_running = True
+        camera = new_camera
         
         print("カメラ初期化完了（上下左右反転）")
         return True
@@ -138,44 +639,770 @@ def init_camera():
         print(f"カメラ初期化エラー: {e}")
         return False
 
+class Subsystem:
+    """
+    起動時に初期化するサブシステム1つ分の状態（health）
+    専用スレッドで初期化し、失敗した場合や動作中に確認に失敗した場合は
+    縮退状態（degraded）にして間隔を延ばしながら初期化をやり直す
+    state: 'initializing'（初回の初期化中） / 'ready' / 'degraded'
+    blocking: 初期化がCの拡張でブロックする場合True（geventではOSスレッドで実行する）
+    """
+    def __init__(self, name, init, check=None, blocking=False):
+        self.name = name
+        self._init = init
+        self._check = check
+        self._blocking = blocking
+        self._ready = threading.Event()
+        self.state = 'initializing'
+        self.attempts = 0
+        self.error = None
+        self.ready_seconds = None  # 起動から初めて使えるようになるまでの秒数
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True, name=f'init-{self.name}').start()
+
+    def wait_ready(self, timeout=None):
+        """使えるようになるまで待つ（return: 使える場合True）"""
+        return self._ready.wait(timeout)
+
+    def _set_state(self, state, error=None):
+        self.state = state
+        self.error = error
+        telemetry.update(health=get_health_summary())
+
+    def _attempt(self):
+        self.attempts += 1
+        started = time.monotonic()
+        try:
+            # Picamera2・PixelStripの初期化はブロックするため、geventではOSスレッドで実行する
+            # pigpioはソケットを開いたハブでしか使えないため、呼び出し元のグリーンレットで初期化する
+            ok = run_blocking(self._init) if self._blocking else self._init()
+            error = None if ok else '初期化に失敗しました'
+        except Exception as e:
+            ok, error = False, str(e)
+        seconds = round(time.monotonic() - started, 3)
+        if ok:
+            event_log.info('subsystem_init', f'{self.name}の初期化完了', attempt=self.attempts, seconds=seconds)
+        else:
+            event_log.warning('subsystem_init', f'{self.name}の初期化失敗', attempt=self.attempts,
+                              seconds=seconds, error=error)
+        return ok, error
+
+    def _run(self):
+        retry = SUBSYSTEM_RETRY_INTERVAL
+        while True:
+            ok, error = self._attempt()
+            if not ok:
+                self._set_state('degraded', error)
+                time.sleep(retry)
+                retry = min(retry * 2, SUBSYSTEM_RETRY_MAX_INTERVAL)
+                continue
+            
+            retry = SUBSYSTEM_RETRY_INTERVAL
+            if self.ready_seconds is None:
+                self.ready_seconds = round(time.monotonic() - boot_started, 3)
+                startup_seconds.set(self.ready_seconds, phase=self.name)
+            self._set_state('ready')
+            self._ready.set()
+            
+            if self._check is None:
+                return
+            # 動作中に使えなくなったら縮退状態にして初期化し直す
+            while self._check():
+                time.sleep(SUBSYSTEM_CHECK_INTERVAL)
+            event_log.warning('subsystem_lost', f'{self.name}が使えなくなりました')
+            self._ready.clear()
+            self._set_state('degraded', '動作中に接続が失われました')
+
+    def status(self):
+        return {
+            'state': self.state,
+            'attempts': self.attempts,
+            'error': self.error,
+            'ready_seconds': self.ready_seconds
+        }
+
+def check_pigpio():
+    """
+    pigpioデーモンとの接続が生きているか
+    pi.connectedは接続時と stop() でしか変わらないため、実際にコマンドを1往復させて確認する
+    """
+    connected = False
+    if pi is not None:
+        try:
+            pi.get_current_tick()
+            connected = True
+        except Exception:
+            pass
+    if not connected:
+        telemetry.update(connected=False)
+    return connected
+
+subsystems = {}
+if not VIDEO_ONLY:
+    subsystems['pigpio'] = Subsystem('pigpio', init_pigpio, check=check_pigpio)
+    subsystems['neopixel'] = Subsystem('neopixel', init_neopixel, blocking=True)
+# 共有メモリから読む場合はcapture_daemon.pyがカメラを持つ
+if CAPTURE_SOURCE != 'shm':
+    subsystems['camera'] = Subsystem('camera', init_camera, blocking=True)
+
+def get_health_summary():
+    """サブシステムごとの状態（テレメトリ用）"""
+    return {name: subsystem.state for name, subsystem in subsystems.items()}
+
+def capture_to_encoders(pool, encoders, detector=None, vision=None):
+    """このプロセスのカメラからフレームを1枚キャプチャしてエンコーダーに渡す（capture_pipeline.capture_frame）"""
+    frames_captured.inc()
+    capture_fps.tick()
+    capture_frame(camera, pool, encoders, detector, vision, run=run_blocking)
+
 def capture_frames():
     """カメラからフレームを取得し続ける関数"""
-    global output_frame, frame_lock
-    
+    global camera_running, stream_active
+
     while True:
         try:
             if camera is None:
                 time.sleep(0.1)
                 continue
-                
-            # フレームを取得
-            frame = camera.capture_array()
-            
-            # フレームをJPEGエンコード
-            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+
+            # 視聴者のいるレンディションだけをエンコード対象にする
+            watched = [r for r in stream_renditions.values() if r.broker.viewers > 0]
             
-            # グローバル変数に保存（スレッドセーフ）
-            with frame_lock:
-                output_frame = buffer.tobytes()
+            # 視聴者がおらずフレーム解析も無効な間はキャプチャとエンコードを休止
+            if not watched and not vision_stage.active:
+                if stream_active:
+                    stream_active = False
+                    print("視聴者がいないため映像配信を休止します")
+                if CAMERA_IDLE_STOP and camera_running:
+                    run_blocking(camera.stop)
+                    camera_running = False
+                wait_for_viewers(timeout=1.0)
+                continue
+
+            if not camera_running:
+                run_blocking(camera.start)
+                camera_running = True
+            if not stream_active:
+                stream_active = True
+                print("映像配信を再開します")
+
+            # フレームを取得し、各レンディションのエンコードプールに渡す（キャプチャ順に配信される）
+            # 解析だけのために動いている間は変化検出を行わない
+            capture_to_encoders(capture_pool, [r.encoder for r in watched],
+                                change_detector if watched else None, vision_stage)
                 
         except Exception as e:
             print(f"フレーム取得エラー: {e}")
             time.sleep(0.1)
 
-def generate_video_stream():
-    """ビデオストリーム用のジェネレータ"""
-    global output_frame, frame_lock
+class StreamClient:
+    """
+    /video_feed クライアント1つ分の配信状態
+    max_fpsによるペーシングと、送信数・スキップ数・遅延の統計を持つ
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, rendition, max_fps=None):
+        self.id = next(self._ids)
+        self.rendition = rendition.name
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.lag = 0.0  # キャプチャから送信完了までの時間（秒）
+
+    def status(self):
+        """クライアントの統計"""
+        return {
+            'id': self.id,
+            'rendition': self.rendition,
+            'max_fps': round(1.0 / self.min_interval, 2) if self.min_interval else None,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'lag_ms': round(self.lag * 1000, 1)
+        }
+
+stream_clients = {}
+stream_clients_lock = threading.Lock()
+
+frame_ring_received = {}  # レンディション名 -> リングから最後にフレームを読んだ時刻（time.monotonic()）
+
+def frame_ring_streaming():
+    """共有メモリから読む場合に、直近FRAME_RING_STALE_TIMEOUT秒以内にフレームが届いているか"""
+    now = time.monotonic()
+    return any(now - received < FRAME_RING_STALE_TIMEOUT for received in frame_ring_received.values())
+
+def read_frame_ring(rendition):
+    """
+    capture_daemon.py が書き込む共有メモリリングからフレームを読み、
+    レンディションのブローカーに発行する（CAPTURE_SOURCE = 'shm' の場合のキャプチャスレッド）
+    リングからのコピーはプロセスごとに1回で、以降は全クライアントで同じバイト列を共有する
+    """
+    ring = None
+    sequence = 0
+    missing_reported = False
     
     while True:
-        # フレームが利用可能になるまで待機
-        with frame_lock:
-            if output_frame is None:
+        try:
+            # このレンディションに視聴者がいない間は読み出さない（デーモン側もエンコードを止める）
+            if rendition.broker.viewers == 0:
+                wait_for_viewers(timeout=1.0, renditions=[rendition])
+                continue
+            
+            if ring is None:
+                ring = FrameRing.attach(ring_name(rendition.name))
+                sequence = ring.sequence
+                missing_reported = False
+                print(f"フレームリングに接続しました: {rendition.name}")
+            
+            ring.touch_reader()
+            # 共有メモリから直接multipartチャンクを組み立てる（コピーは1回）
+            sequence, frame, captured_at = ring.read_latest(sequence, wrap=EncodedFrame)
+            if frame is not None:
+                frame_ring_received[rendition.name] = time.monotonic()
+                rendition.broker.publish(frame, captured_at)
+                continue
+            
+            # デーモンが再起動した場合は新しいリングに接続し直す
+            if time.monotonic() - ring.producer_heartbeat > FRAME_RING_STALE_TIMEOUT:
+                print(f"フレームリングの更新が止まっています: {rendition.name}")
+                ring.close()
+                ring = None
+                continue
+            time.sleep(FRAME_RING_POLL_INTERVAL)
+            
+        except FileNotFoundError:
+            if not missing_reported:
+                print(f"フレームリングが見つかりません（capture_daemon.py は起動していますか）: {rendition.name}")
+                missing_reported = True
+            time.sleep(1.0)
+        except Exception as e:
+            print(f"フレームリング読み出しエラー: {e}")
+            if ring is not None:
+                ring.close()
+                ring = None
+            time.sleep(0.1)
+
+def generate_video_stream(rendition, client):
+    """
+    ビデオストリーム用のジェネレータ
+    WSGIサーバーは前のチャンクを書き終えるまで次を要求しないため、
+    送信が追いつかないクライアントは間のフレームを飛ばして最新フレームを受け取る
+    """
+    frame_broker = rendition.broker
+    
+    # 現在のフレームより新しいものから配信する
+    sequence, _, _ = frame_broker.latest()
+    frame_broker.add_viewer()
+    with stream_clients_lock:
+        stream_clients[client.id] = client
+    next_send = 0.0
+    
+    try:
+        while True:
+            # max_fpsが指定されている場合は送信間隔を空ける
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            
+            # 前回送信したものより新しいフレームが届くまで待機
+            latest, frame, captured_at = frame_broker.wait_for_frame(sequence, timeout=1.0)
+            if frame is None:
+                continue
+            if client.frames_sent:
+                client.frames_dropped += latest - sequence - 1
+            sequence = latest
+            next_send = time.monotonic() + client.min_interval
+            
+            # 組み立て済みのmultipartチャンクをそのまま返す（クライアントごとの連結はしない）
+            yield frame.chunk
+            
+            # ここに戻った時点でソケットへの書き込みが完了している
+            client.frames_sent += 1
+            client.lag = time.time() - captured_at
+    finally:
+        # クライアント切断時に視聴者登録を解除
+        frame_broker.remove_viewer()
+        with stream_clients_lock:
+            stream_clients.pop(client.id, None)
+
+class SocketVideoSubscriber:
+    """
+    Socket.IO経由のバイナリ映像配信の購読者（オプトイン）
+    video_frameイベントでJPEGをシーケンス番号・キャプチャ時刻付きで送り、
+    クライアントのvideo_ackで未確認フレーム数をwindow以下に保つ
+    """
+    def __init__(self, sid, rendition, window=SOCKET_VIDEO_WINDOW):
+        self.sid = sid
+        self.rendition = rendition
+        self.window = max(1, window)
+        self.active = True
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.rtt = 0.0  # 送信からackまでの時間（秒）
+        self._unacked = OrderedDict()  # シーケンス番号 -> 送信時刻（time.monotonic()）
+        self._condition = Condition()
+
+    def acknowledge(self, sequence):
+        """sequence以下の未確認フレームを確認済みにする"""
+        now = time.monotonic()
+        with self._condition:
+            while self._unacked:
+                head = next(iter(self._unacked))
+                if head > sequence:
+                    break
+                sent_at = self._unacked.pop(head)
+                if head == sequence:
+                    self.rtt = now - sent_at
+            self._condition.notify_all()
+
+    def wait_for_window(self, timeout):
+        """
+        未確認フレームがwindow未満になるまで待機する
+        ackが返ってこないフレームはSOCKET_VIDEO_ACK_TIMEOUTで失ったものとみなす
+        """
+        with self._condition:
+            deadline = time.monotonic() + timeout
+            while self.active:
+                now = time.monotonic()
+                while self._unacked and now - next(iter(self._unacked.values())) > SOCKET_VIDEO_ACK_TIMEOUT:
+                    self._unacked.popitem(last=False)
+                if len(self._unacked) < self.window:
+                    return True
+                if now >= deadline:
+                    return False
+                self._condition.wait(min(deadline - now, SOCKET_VIDEO_ACK_TIMEOUT))
+            return False
+
+    def mark_sent(self, sequence):
+        """送信済み（ack待ち）として記録"""
+        with self._condition:
+            self._unacked[sequence] = time.monotonic()
+            self.frames_sent += 1
+
+    def stop(self):
+        """配信ループを停止"""
+        with self._condition:
+            self.active = False
+            self._condition.notify_all()
+
+    def status(self):
+        """購読者の統計"""
+        return {
+            'sid': self.sid,
+            'rendition': self.rendition.name,
+            'window': self.window,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'rtt_ms': round(self.rtt * 1000, 1)
+        }
+
+socket_video_subscribers = {}
+socket_video_lock = threading.Lock()
+
+def push_socket_video(subscriber):
+    """Socket.IO購読者にフレームを送り続けるバックグラウンドタスク"""
+    frame_broker = subscriber.rendition.broker
+    sequence, _, _ = frame_broker.latest()
+    frame_broker.add_viewer()
+    
+    try:
+        while subscriber.active:
+            # ackが追いつくまで次のフレームを送らない
+            if not subscriber.wait_for_window(timeout=1.0):
+                continue
+            
+            latest, frame, captured_at = frame_broker.wait_for_frame(sequence, timeout=1.0)
+            if frame is None or not subscriber.active:
+                continue
+            if subscriber.frames_sent:
+                subscriber.frames_dropped += latest - sequence - 1
+            sequence = latest
+            
+            subscriber.mark_sent(sequence)
+            socketio.emit('video_frame', {
+                'seq': sequence,
+                'timestamp': captured_at,
+                'sent_at': time.time(),
+                'data': frame.jpeg
+            }, to=subscriber.sid)
+    finally:
+        frame_broker.remove_viewer()
+
+def stop_socket_video(sid):
+    """sidのSocket.IO映像配信を停止"""
+    with socket_video_lock:
+        subscriber = socket_video_subscribers.pop(sid, None)
+    if subscriber:
+        subscriber.stop()
+    return subscriber is not None
+
+def stream_socket(environ):
+    """
+    リクエストの接続ソケット（見つからない場合はNone）
+    werkzeug・gunicornはenvironに入れるが、gevent.pywsgiは入れないため
+    wsgi.input の読み込み元（socket.makefile）からたどる
+    """
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    if sock is None and ASYNC_MODE == 'gevent':
+        reader = environ.get('wsgi.input')
+        reader = getattr(reader, 'rfile', reader)
+        sock = getattr(getattr(reader, 'raw', None), '_sock', None)
+    return sock
+
+def limit_send_buffer(environ):
+    """
+    ストリーム用ソケットの送信バッファを小さくする
+    カーネル内に溜まるフレームを減らし、低速クライアントの遅延を一定に抑える
+    ソケットを取得できないサーバーでは設定されない（最初の1回だけ出力する）
+    """
+    global send_buffer_unavailable_reported
+    if not STREAM_SNDBUF:
+        return
+    sock = stream_socket(environ)
+    if sock is None:
+        if not send_buffer_unavailable_reported:
+            send_buffer_unavailable_reported = True
+            print("このサーバーではストリームの送信バッファを設定できません（STREAM_SNDBUFは無効）")
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, STREAM_SNDBUF)
+    except (OSError, AttributeError) as e:
+        print(f"送信バッファ設定エラー: {e}")
+
+def get_stream_status():
+    """
+    映像配信の状態を返す
+    共有メモリから読む場合はカメラを capture_daemon.py が持つため、リングからフレームが届いているかで判断する
+    """
+    if CAPTURE_SOURCE == 'shm':
+        active = running = frame_ring_streaming()
+    else:
+        active, running = stream_active, camera_running
+    return {
+        'source': CAPTURE_SOURCE,
+        'state': 'active' if active else 'idle',
+        'viewers': sum(r.broker.viewers for r in stream_renditions.values()),
+        'camera_running': running,
+        'renditions': {name: r.status() for name, r in stream_renditions.items()},
+        'capture_pool': capture_pool.status(),
+        'change_detection': change_detector.status() if change_detector else None,
+        'clients': [c.status() for c in list(stream_clients.values())],
+        'socket_clients': [s.status() for s in list(socket_video_subscribers.values())],
+        'recording': recorder.status(),
+        'timeshift': timeshift.status(),
+        'vision': vision_stage.status()
+    }
+
+class FrameRecorder:
+    """
+    エンコード済みフレームをセグメントファイルに書き込む録画機
+    ブローカーのリスナーとして有界キューにフレームを入れるだけで、ディスクへの書き込みは
+    専用スレッドが行う（キューが溢れたフレームは破棄し、キャプチャと配信を待たせない）
+    セグメントは <開始時刻>.mjpeg（JPEGの連結）と <開始時刻>.idx（RECORDING_INDEXの配列）の組
+    """
+    def __init__(self, directory=RECORDING_DIR, segment_seconds=RECORDING_SEGMENT_SECONDS,
+                 quota_bytes=RECORDING_QUOTA_BYTES, min_free_bytes=RECORDING_MIN_FREE_BYTES,
+                 queue_size=RECORDING_QUEUE_SIZE):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._session = 0
+        self._queue = None
+        self._writer = None
+        self._rendition = None
+        self._total_bytes = 0
+        self.recording = False
+        self.segment = None
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.segments_deleted = 0
+
+    def start(self, rendition):
+        """
+        録画を開始（録画中の場合はFalse、ブロックしない）
+        前回の書き込みスレッドが残りのフレームを書き終えるのは新しい書き込みスレッドが待つ
+        （容量のカウンターを2つのスレッドが同時に更新しないため、待っている間のフレームはキューに溜まる）
+        """
+        with self._lock:
+            if self.recording:
+                return False
+            previous = self._writer
+            os.makedirs(self.directory, exist_ok=True)
+            self._session += 1
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._rendition = rendition
+            self.recording = True
+            self.frames_written = 0
+            self.frames_dropped = 0
+            self._writer = threading.Thread(target=self._write_loop,
+                                            args=(self._session, self._queue, previous),
+                                            daemon=True, name='recorder')
+            self._writer.start()
+        
+        # 録画中はレンディションの視聴者として数え、視聴者がいなくてもエンコードさせる
+        rendition.broker.add_listener(self._enqueue)
+        rendition.broker.add_viewer()
+        telemetry.update(recording=True)
+        return True
+
+    def stop(self):
+        """録画を停止（キューに残ったフレームは書き込んでからセグメントを閉じる）"""
+        with self._lock:
+            if not self.recording:
+                return False
+            self.recording = False
+            rendition = self._rendition
+        rendition.broker.remove_listener(self._enqueue)
+        rendition.broker.remove_viewer()
+        telemetry.update(recording=False)
+        return True
+
+    def _enqueue(self, frame, captured_at):
+        """ブローカーから呼ばれる（ブロックしない）"""
+        try:
+            self._queue.put_nowait((frame, captured_at))
+        except queue.Full:
+            self.frames_dropped += 1
+
+    def _segments(self):
+        """既存のセグメント名（古い順）"""
+        return sorted(name[:-len('.mjpeg')] for name in os.listdir(self.directory)
+                      if name.endswith('.mjpeg'))
+
+    def _segment_bytes(self, segment):
+        """セグメントのデータとインデックスの合計サイズ"""
+        total = 0
+        for extension in ('.mjpeg', '.idx'):
+            try:
+                total += os.path.getsize(os.path.join(self.directory, segment + extension))
+            except OSError:
+                pass
+        return total
+
+    def _delete_oldest(self, current):
+        """
+        書き込み中以外で最も古いセグメントを削除する
+        return: 削除した場合True、削除できるセグメントがない場合False
+        """
+        for segment in self._segments():
+            if segment == current:
                 continue
-            frame = output_frame
+            size = self._segment_bytes(segment)
+            for extension in ('.mjpeg', '.idx'):
+                try:
+                    os.remove(os.path.join(self.directory, segment + extension))
+                except FileNotFoundError:
+                    pass
+            self._total_bytes -= size
+            self.segments_deleted += 1
+            print(f"録画セグメントを削除しました: {segment}")
+            return True
+        return False
+
+    def _make_room(self, size, current):
+        """
+        sizeバイト書き込めるよう、容量上限とディスクの空きを満たすまで古いセグメントを削除する
+        return: 書き込める場合True
+        """
+        while self._total_bytes + size > self.quota_bytes:
+            if not self._delete_oldest(current):
+                return False
+        while shutil.disk_usage(self.directory).free - size < self.min_free_bytes:
+            if not self._delete_oldest(current):
+                return False
+        return True
+
+    def _write_loop(self, session, frames, previous=None):
+        """書き込みスレッド（previous: 先に書き終えるのを待つ前回の書き込みスレッド）"""
+        segment = None
+        data_file = index_file = None
+        started_at = 0.0
+        room_checked_at = 0.0
+        if previous is not None:
+            previous.join()
+        self._total_bytes = sum(self._segment_bytes(name) for name in self._segments())
         
-        # HTTPレスポンス形式でフレームを返す
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+        try:
+            while (self.recording and self._session == session) or not frames.empty():
+                try:
+                    frame, captured_at = frames.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                
+                # セグメントの切り替え
+                if segment is None or captured_at - started_at >= self.segment_seconds:
+                    if data_file:
+                        data_file.close()
+                        index_file.close()
+                    started_at = captured_at
+                    segment = time.strftime('%Y%m%d-%H%M%S', time.localtime(captured_at)) + \
+                        f'-{int(captured_at * 1000) % 1000:03d}'
+                    data_file = open(os.path.join(self.directory, segment + '.mjpeg'), 'wb')
+                    index_file = open(os.path.join(self.directory, segment + '.idx'), 'wb')
+                    if self._session == session:
+                        self.segment = segment
+                    room_checked_at = 0.0
+                
+                # 容量の確認（ディスクの空きは1秒ごと）
+                size = len(frame) + RECORDING_INDEX.size
+                if self._total_bytes + size > self.quota_bytes or captured_at - room_checked_at >= 1.0:
+                    room_checked_at = captured_at
+                    if not self._make_room(size, segment):
+                        if self._session == session:
+                            self.frames_dropped += 1
+                        continue
+                
+                try:
+                    offset = data_file.tell()
+                    run_blocking(data_file.write, frame.view)
+                    index_file.write(RECORDING_INDEX.pack(captured_at, offset, len(frame)))
+                except OSError as e:
+                    # ディスクが一杯になった場合などはフレームを破棄して続ける
+                    print(f"録画書き込みエラー: {e}")
+                    if self._session == session:
+                        self.frames_dropped += 1
+                    room_checked_at = 0.0
+                    continue
+                self._total_bytes += size
+                # 次の録画が始まった後に残りを書き込んでいる間は、新しい録画の統計に数えない
+                if self._session == session:
+                    self.frames_written += 1
+        except Exception as e:
+            print(f"録画エラー: {e}")
+            if self._session == session:
+                self.stop()
+        finally:
+            if data_file:
+                data_file.close()
+                index_file.close()
+            if self._session == session:
+                self.segment = None
+
+    def status(self):
+        """録画の状態"""
+        return {
+            'recording': self.recording,
+            'profile': self._rendition.name if self._rendition else None,
+            'segment': self.segment,
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'queued': self._queue.qsize() if self._queue else 0,
+            'bytes': self._total_bytes,
+            'quota_bytes': self.quota_bytes,
+            'segments_deleted': self.segments_deleted
+        }
+
+recorder = FrameRecorder()
+
+class TimeShiftBuffer:
+    """
+    直近TIMESHIFT_SECONDS秒分のエンコード済みフレームを保持するメモリ上のリング
+    ブローカーが発行したフレームオブジェクトをそのまま参照するため、フレームは二重に持たない
+    秒数とバイト数の両方で上限を設け、古いものから捨てる
+    """
+    def __init__(self, seconds=TIMESHIFT_SECONDS, max_bytes=TIMESHIFT_MAX_BYTES):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self._condition = Condition()
+        self._frames = deque()  # (キャプチャ時刻, フレーム) のキャプチャ順
+        self._timestamps = deque()  # _framesと同じ順のキャプチャ時刻（bisect用、key=はPython 3.10以降のため）
+        self._bytes = 0
+        self._rendition = None
+        self.evicted = 0
+
+    def start(self, rendition):
+        """レンディションのフレームを溜め始める（溜めている間は視聴者として数える）"""
+        self._rendition = rendition
+        rendition.broker.add_listener(self._append)
+        rendition.broker.add_viewer()
+
+    def stop(self):
+        """フレームの蓄積を止める"""
+        if self._rendition is None:
+            return
+        self._rendition.broker.remove_listener(self._append)
+        self._rendition.broker.remove_viewer()
+        self._rendition = None
+
+    @property
+    def rendition(self):
+        """蓄積中のレンディション（停止中はNone）"""
+        return self._rendition
+
+    def _append(self, frame, captured_at):
+        """ブローカーから呼ばれる（古いフレームを捨てて追加するだけでブロックしない）"""
+        with self._condition:
+            self._frames.append((captured_at, frame))
+            self._timestamps.append(captured_at)
+            self._bytes += len(frame)
+            while self._frames and (captured_at - self._frames[0][0] > self.seconds
+                                    or self._bytes > self.max_bytes):
+                _, old = self._frames.popleft()
+                self._timestamps.popleft()
+                self._bytes -= len(old)
+                self.evicted += 1
+            self._condition.notify_all()
+
+    def frame_after(self, timestamp, timeout=None):
+        """
+        timestampより後にキャプチャされた最も古いフレームを返す
+        まだ届いていなければtimeoutまで待つ
+        return: (キャプチャ時刻, フレーム)、タイムアウト時は (None, None)
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self._frames and self._frames[-1][0] > timestamp, timeout):
+                return None, None
+            index = bisect.bisect_right(self._timestamps, timestamp)
+            return self._frames[index]
+
+    def status(self):
+        """保持しているフレームの範囲"""
+        with self._condition:
+            span = self._frames[-1][0] - self._frames[0][0] if self._frames else 0.0
+            return {
+                'profile': self._rendition.name if self._rendition else None,
+                # 蓄積中は視聴者として数えるため、キャプチャとエンコードは休止しない
+                'holds_viewer': self._rendition is not None,
+                'seconds': self.seconds,
+                'buffered_seconds': round(span, 2),
+                'frames': len(self._frames),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evicted': self.evicted
+            }
+
+timeshift = TimeShiftBuffer()
+command_trace = CommandTrace(TRACE_DIR)
+
+def generate_replay_stream(seconds_ago, speed):
+    """
+    タイムシフトバッファからseconds_ago秒前以降のフレームを、
+    キャプチャ間隔をspeedで割った間隔で順に送るジェネレータ
+    speedが1より大きければ最新に追いついた後はライブと同じ速さで続ける
+    """
+    timestamp = time.time() - seconds_ago
+    previous = None
+    next_send = time.monotonic()
+    
+    while True:
+        captured_at, frame = timeshift.frame_after(timestamp, timeout=1.0)
+        if frame is None:
+            continue
+        # キャプチャ間隔に合わせて送信時刻を決める（バッファから落ちて飛んだ分は待たない）
+        if previous is not None:
+            next_send += min(captured_at - previous, 1.0) / speed
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_send = time.monotonic()
+        previous = timestamp = captured_at
+        yield frame.chunk
 
 def angle_to_pulse_width(angle):
     """
@@ -191,9 +1418,8 @@ def set_servo_angle(pin, angle):
     pin: GPIOピン番号
     angle: 0-180度
     """
-    global pi
     if pi is None or not pi.connected:
-        print("pigpioが初期化されていません")
+        event_log.warning('pigpio_unavailable', 'pigpioが初期化されていません')
         return
     
     # 角度を0-180度の範囲に制限
@@ -223,12 +1449,7 @@ def control_servo(servo_type, direction):
         elif direction == 'center':
             current_pitch = 90
         
-        set_servo_angle(SERVO_PITCH, current_pitch)
-        socketio.emit('servo_status', {
-            'type': 'pitch', 
-            'angle': current_pitch,
-            'direction': direction
-        })
+        pitch_axis.set_target(current_pitch, direction)
         
     elif servo_type == 'yaw':
         if direction == 'left':
@@ -238,112 +1459,298 @@ def control_servo(servo_type, direction):
         elif direction == 'center':
             current_yaw = 90
         
-        set_servo_angle(SERVO_YAW, current_yaw)
-        socketio.emit('servo_status', {
-            'type': 'yaw',
-            'angle': current_yaw,
-            'direction': direction
-        })
+        yaw_axis.set_target(current_yaw, direction)
+
+def clamp_color(value):
+    """RGBの1要素を明度テーブルの添字に使える整数 (0-255) にする"""
+    return int(max(0, min(255, value)))
 
 def set_led_color(led_index, r, g, b):
     """
-    指定したLEDの色を設定
+    指定したLEDの色を設定（実行中のアニメーションは停止する）
     led_index: LEDのインデックス (0-5、-1で全LED)
     r, g, b: RGB値 (0-255)
     """
-    global strip, led_brightness
     if strip is None:
-        print("NeoPixel LEDが初期化されていません")
+        event_log.warning('neopixel_unavailable', 'NeoPixel LEDが初期化されていません')
         return
     
-    # 明度を適用
-    brightness_factor = led_brightness / 100.0
-    r = int(r * brightness_factor)
-    g = int(g * brightness_factor)
-    b = int(b * brightness_factor)
-    
-    color = Color(r, g, b)
-    
-    if led_index == -1:  # 全てのLED
-        for i in range(LED_COUNT):
-            strip.setPixelColor(i, color)
-    else:  # 指定したLED
-        if 0 <= led_index < LED_COUNT:
-            strip.setPixelColor(led_index, color)
-    
-    strip.show()
+    led_engine.stop_animation()
+    led_engine.set_pixels(led_index, (clamp_color(r), clamp_color(g), clamp_color(b)))
 
 def set_led_brightness(brightness):
     """LED明度を設定 (0-100%)"""
     global led_brightness
-    led_brightness = max(0, min(100, brightness))
-    socketio.emit('led_status', {'brightness': led_brightness})
+    # 明度テーブルの添字に使うため整数にする
+    led_brightness = int(max(0, min(100, brightness)))
+    led_engine.invalidate()
+    telemetry.update(led_brightness=led_brightness)
 
-def led_animation_rainbow():
-    """レインボーアニメーション"""
-    global strip
-    if strip is None:
-        return
-    
-    import math
-    
-    for j in range(256):
-        for i in range(LED_COUNT):
-            pixel_index = (i * 256 // LED_COUNT) + j
-            r = int((math.sin(pixel_index * 0.024) + 1) * 127)
-            g = int((math.sin(pixel_index * 0.024 + 2) + 1) * 127)
-            b = int((math.sin(pixel_index * 0.024 + 4) + 1) * 127)
+LED_COMMANDS = ('set_color', 'set_brightness', 'animation_rainbow', 'animation_chase', 'off')
+
+def apply_led_command(data):
+    """
+    led_controlと同じ形式のLEDコマンドを実行する
+    return: 未知のアクションの場合False
+    """
+    action = data.get('action')
+    if action == 'set_color':
+        led_index = data.get('led_index', -1)  # -1で全LED
+        r = data.get('r', 0)
+        g = data.get('g', 0)
+        b = data.get('b', 0)
+        set_led_color(led_index, r, g, b)
+        
+    elif action == 'set_brightness':
+        brightness = data.get('brightness', 100)
+        set_led_brightness(brightness)
+        
+    elif action == 'animation_rainbow':
+        led_engine.play(RainbowAnimation())
+        
+    elif action == 'animation_chase':
+        r = data.get('r', 255)
+        g = data.get('g', 0)
+        b = data.get('b', 0)
+        led_engine.play(ChaseAnimation(r, g, b))
+        
+    elif action == 'off':
+        set_led_color(-1, 0, 0, 0)  # アニメーションを止めて全LED消灯
+        
+    else:
+        return False
+    return True
+
+class LedAnimation:
+    """
+    LEDアニメーションの基底クラス
+    renderは開始からの経過時間に対応するフレーム（LEDごとの(r, g, b)）を返し、
+    終了したらNoneを返す
+    """
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        """アニメーションを中断"""
+        self.cancelled = True
+
+    def render(self, elapsed):
+        raise NotImplementedError
+
+class RainbowAnimation(LedAnimation):
+    """レインボーアニメーション（20msごとに1ステップ、256ステップ）"""
+    name = 'rainbow'
+    step_interval = 0.02
+    steps = 256
+
+    def render(self, elapsed):
+        j = int(elapsed / self.step_interval)
+        if j >= self.steps:
+            return None
+        return [LED_RAINBOW_TABLE[offset + j] for offset in LED_RAINBOW_OFFSETS]
+
+class ChaseAnimation(LedAnimation):
+    """チェイスアニメーション（200msごとに点灯するLEDが1つずつ進む）"""
+    name = 'chase'
+    step_interval = 0.2
+
+    def __init__(self, r, g, b):
+        super().__init__()
+        self.color = (clamp_color(r), clamp_color(g), clamp_color(b))
+
+    def render(self, elapsed):
+        i = int(elapsed / self.step_interval)
+        if i >= LED_COUNT:
+            return None
+        return [self.color if j == i else (0, 0, 0) for j in range(LED_COUNT)]
+
+class LedRenderEngine:
+    """
+    LEDの描画を1つのスレッドに集約するレンダーエンジン
+    ピクセルバッファ（明度適用前のRGB）とアニメーションを持ち、
+    LED_FRAME_RATEのフレームクロックで描画する
+    明度はテーブル参照で適用し、出力が前回と同じ場合はshow()を呼ばない
+    """
+    def __init__(self):
+        self._condition = Condition()
+        self._pixels = [(0, 0, 0)] * LED_COUNT
+        self._animation = None
+        self._animation_started = 0.0
+        self._dirty = False
+        self._shown = None
+        self.frames_shown = 0
+        self.frames_skipped = 0
+
+    def set_pixels(self, led_index, rgb):
+        """バッファの色を設定（-1で全LED）"""
+        with self._condition:
+            if led_index == -1:
+                self._pixels = [rgb] * LED_COUNT
+            elif 0 <= led_index < LED_COUNT:
+                self._pixels[led_index] = rgb
+            self._dirty = True
+            self._condition.notify()
+            colors = ['#%02x%02x%02x' % pixel for pixel in self._pixels]
+        telemetry.update(led_colors=colors)
+
+    def invalidate(self):
+        """明度の変更などで再描画が必要なことを通知"""
+        with self._condition:
+            self._dirty = True
+            self._condition.notify()
+
+    def reset(self):
+        """ストリップを初期化し直した（全LEDが消灯している）ので、次のフレームで全て書き直す"""
+        with self._condition:
+            self._shown = None
+            self._dirty = True
+            self._condition.notify()
+
+    def play(self, animation):
+        """実行中のアニメーションを中断して新しいアニメーションを開始"""
+        with self._condition:
+            if self._animation:
+                self._animation.cancel()
+            self._animation = animation
+            self._animation_started = time.monotonic()
+            self._condition.notify()
+        telemetry.update(led_animation=animation.name)
+
+    def stop_animation(self):
+        """実行中のアニメーションを中断（最後のフレームのまま残す）"""
+        with self._condition:
+            if self._animation:
+                self._animation.cancel()
+                self._animation = None
+        telemetry.update(led_animation=None)
+
+    @property
+    def animation(self):
+        """実行中のアニメーション名"""
+        animation = self._animation
+        return animation.name if animation else None
+
+    def run(self):
+        """レンダースレッドのメインループ"""
+        interval = 1.0 / LED_FRAME_RATE
+        next_tick = time.monotonic()
+        
+        while True:
+            with self._condition:
+                # アニメーションも再描画要求もない間は待機する
+                self._condition.wait_for(lambda: self._animation or self._dirty)
+                animation = self._animation
+                if animation and not animation.cancelled:
+                    frame = animation.render(time.monotonic() - self._animation_started)
+                    if frame is None:
+                        self._animation = None
+                        telemetry.update(led_animation=None)
+                    else:
+                        self._pixels = frame
+                self._dirty = False
+                pixels = list(self._pixels)
             
-            # 明度を適用
-            brightness_factor = led_brightness / 100.0
-            r = int(r * brightness_factor)
-            g = int(g * brightness_factor)
-            b = int(b * brightness_factor)
+            try:
+                self._show(pixels)
+            except Exception as e:
+                event_log.error('led_render_error', 'LED描画エラー', error=str(e))
             
-            strip.setPixelColor(i, Color(r, g, b))
-        
-        strip.show()
-        time.sleep(0.02)
+            if self._animation is None:
+                next_tick = time.monotonic()
+                continue
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
 
-def led_animation_chase(r, g, b):
-    """チェイスアニメーション"""
-    global strip
-    if strip is None:
-        return
-    
-    brightness_factor = led_brightness / 100.0
-    r = int(r * brightness_factor)
-    g = int(g * brightness_factor)
-    b = int(b * brightness_factor)
-    
-    for i in range(LED_COUNT):
-        # 全て消灯
-        for j in range(LED_COUNT):
-            strip.setPixelColor(j, Color(0, 0, 0))
+    def _show(self, pixels):
+        """明度を適用してストリップに反映（変化がなければshow()を省略）"""
+        if strip is None:
+            return
+        table = LED_BRIGHTNESS_TABLE[led_brightness]
+        colors = [Color(table[r], table[g], table[b]) for r, g, b in pixels]
+        if colors == self._shown:
+            command_latency.discard('leds')
+            self.frames_skipped += 1
+            return
         
-        # 現在のLEDを点灯
-        strip.setPixelColor(i, Color(r, g, b))
-        strip.show()
-        time.sleep(0.2)
+        for i, color in enumerate(colors):
+            if self._shown is None or self._shown[i] != color:
+                strip.setPixelColor(i, color)
+        command_latency.actuated('leds')
+        run_blocking(strip.show)
+        self._shown = colors
+        self.frames_shown += 1
 
 def stop_led_animation():
     """LEDアニメーションを停止"""
-    global led_animation_timer
-    if led_animation_timer:
-        led_animation_timer.cancel()
-        led_animation_timer = None
+    led_engine.stop_animation()
+
+led_engine = LedRenderEngine()
+
+def write_motor_pins(pwm_value, set_bits):
+    """
+    モーターのピンをまとめて書き込む
+    pwm_value: ENA/ENBのデューティサイクル (0-255)
+    set_bits: HIGHにするIN1-IN4のビットマスク（バンク1）
+    return: 実際に使った書き込み方式
+    """
+    command_latency.actuated('motors')
+    if MOTOR_BATCH_MODE == 'script' and motor_script_id is not None:
+        # アップロード済みスクリプトで1回の往復にまとめる
+        pi.run_script(motor_script_id, [MOTOR_IN_MASK & ~set_bits, set_bits, ENA, pwm_value, ENB])
+        return 'script'
+    elif MOTOR_BATCH_MODE in ('script', 'bank'):
+        # 先にLOWにするピンを落としてからHIGHにする（片側だけ切り替わった状態を作らない）
+        pi.clear_bank_1(MOTOR_IN_MASK & ~set_bits)
+        if set_bits:
+            pi.set_bank_1(set_bits)
+        pi.set_PWM_dutycycle(ENA, pwm_value)
+        pi.set_PWM_dutycycle(ENB, pwm_value)
+        return 'bank'
+    else:
+        # 従来通り1ピンずつ書き込む（比較計測用）
+        pi.set_PWM_dutycycle(ENA, pwm_value)
+        pi.set_PWM_dutycycle(ENB, pwm_value)
+        for pin in MOTOR_IN_PINS:
+            pi.write(pin, 1 if set_bits & (1 << pin) else 0)
+        return 'single'
+
+def record_motor_command_rtt(mode, elapsed):
+    """
+    モーターピンの書き込みコマンドのソケット往復時間を記録
+    pigpioはコマンド（run_scriptではスクリプトの起動）をデーモンが受け付けた時点で応答するため、
+    ピンに実際に反映されるまでの時間ではなく、書き込み方式ごとの往復回数・通信時間の比較に使う
+    書き込み方式が変わった場合は統計をリセットする
+    """
+    stats = motor_command_rtt_stats
+    if stats['mode'] != mode:
+        stats.update({'mode': mode, 'count': 0, 'last_ms': 0.0, 'avg_ms': 0.0, 'max_ms': 0.0})
+    stats['count'] += 1
+    stats['last_ms'] = elapsed * 1000
+    stats['max_ms'] = max(stats['max_ms'], stats['last_ms'])
+    stats['avg_ms'] += (stats['last_ms'] - stats['avg_ms']) / stats['count']
 
 def move_motors(speed, direction):
     """
     モーターを制御する関数
     speed: 0-100 (パーセンテージ)
     direction: 1=前進, -1=後進, 2=右旋回, -2=左旋回, 0=停止
+    return: pigpioに書き込んだ場合True（pigpioが使えない場合False）
     """
-    global pi, current_speed, current_direction
+    global current_speed, current_direction
     
     if pi is None or not pi.connected:
-        print("pigpioが初期化されていません")
-        return
+        event_log.warning('pigpio_unavailable', 'pigpioが初期化されていません')
+        return False
+    
+    # 未知の方向は停止として扱う
+    if direction not in MOTOR_DIRECTION_BITS:
+        direction = 0
+    if direction == 0:
+        speed = 0
     
     current_speed = speed
     current_direction = direction
@@ -351,53 +1758,574 @@ def move_motors(speed, direction):
     # 速度をPWMデューティサイクルに変換 (0-255)
     pwm_value = int(speed * 255 / 100)
     
-    # PWM設定
-    pi.set_PWM_dutycycle(ENA, pwm_value)
-    pi.set_PWM_dutycycle(ENB, pwm_value)
+    started = time.perf_counter()
+    mode = write_motor_pins(pwm_value, MOTOR_DIRECTION_BITS[direction])
+    record_motor_command_rtt(mode, time.perf_counter() - started)
     
-    if direction == 1:  # 前進
-        pi.write(IN1, 0)
-        pi.write(IN2, 1)
-        pi.write(IN3, 1)
-        pi.write(IN4, 0)
-        socketio.emit('status', {'action': '前進', 'speed': speed})
-    elif direction == -1:  # 後進
-        pi.write(IN1, 1)
-        pi.write(IN2, 0)
-        pi.write(IN3, 0)
-        pi.write(IN4, 1)
-        socketio.emit('status', {'action': '後進', 'speed': speed})
-    elif direction == 2:  # 右旋回
-        pi.write(IN1, 1)
-        pi.write(IN2, 0)
-        pi.write(IN3, 1)
-        pi.write(IN4, 0)
-        socketio.emit('status', {'action': '右旋回', 'speed': speed})
-    elif direction == -2:  # 左旋回
-        pi.write(IN1, 0)
-        pi.write(IN2, 1)
-        pi.write(IN3, 0)
-        pi.write(IN4, 1)
-        socketio.emit('status', {'action': '左旋回', 'speed': speed})
-    else:  # 停止
-        pi.write(IN1, 0)
-        pi.write(IN2, 0)
-        pi.write(IN3, 0)
-        pi.write(IN4, 0)
-        pi.set_PWM_dutycycle(ENA, 0)
-        pi.set_PWM_dutycycle(ENB, 0)
-        socketio.emit('status', {'action': '停止', 'speed': 0})
+    telemetry.update(action=MOTOR_ACTIONS[direction], speed=speed, direction=direction)
+    return True
 
 def stop_motors():
-    """モーターを停止"""
-    move_motors(0, 0)
+    """モーターを停止（更新ループを待たずに即座に反映）"""
+    motor_mailbox.post((0, 0))
+    motor_mailbox.flush()
 
 def auto_stop():
-    """自動停止タイマー"""
-    global move_timer
-    if move_timer:
-        move_timer.cancel()
+    """継続時間経過による自動停止"""
+    stop_motors()
+
+class DeadlineScheduler:
+    """
+    全ての期限付き処理を1つのスレッドで管理するスケジューラ
+    単調時計の期限をヒープで管理し、キーごとに1つの期限を持つ
+    同じキーで再設定すると古い期限は無効になる（再設定はO(log n)、スレッドは作らない）
+    コールバックはスケジューラスレッドで実行されるため短い処理にすること
+    """
+    def __init__(self):
+        self._condition = Condition()
+        self._heap = []      # (期限, 登録番号, キー)
+        self._entries = {}   # キー -> (登録番号, コールバック)
+        self._counter = itertools.count()
+
+    def schedule(self, key, delay, callback):
+        """delay秒後にcallbackを実行する（同じキーの既存の期限は置き換える）"""
+        with self._condition:
+            number = next(self._counter)
+            self._entries[key] = (number, callback)
+            heapq.heappush(self._heap, (time.monotonic() + delay, number, key))
+            # 無効になったエントリが溜まりすぎたら作り直す
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [item for item in self._heap
+                              if self._entries.get(item[2], (None,))[0] == item[1]]
+                heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def call_later(self, delay, callback):
+        """キーを指定せずに期限を登録（取り消し用のキーを返す）"""
+        key = object()
+        self.schedule(key, delay, callback)
+        return key
+
+    def cancel(self, key):
+        """期限を取り消す"""
+        with self._condition:
+            return self._entries.pop(key, None) is not None
+
+    def is_scheduled(self, key):
+        """キーの期限が登録されているか"""
+        with self._condition:
+            return key in self._entries
+
+    def run(self):
+        """スケジューラスレッドのメインループ"""
+        while True:
+            with self._condition:
+                callback = None
+                while callback is None:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    deadline, number, key = self._heap[0]
+                    entry = self._entries.get(key)
+                    if entry is None or entry[0] != number:
+                        # 取り消し・再設定済みのエントリ
+                        heapq.heappop(self._heap)
+                        continue
+                    delay = deadline - time.monotonic()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    del self._entries[key]
+                    callback = entry[1]
+            
+            try:
+                callback()
+            except Exception as e:
+                event_log.error('scheduler_error', 'スケジュール実行エラー', error=str(e))
+
+scheduler = DeadlineScheduler()
+
+def arm_deadman(sid):
+    """走行中のクライアントのデッドマンタイマーを設定・延長"""
+    if DEADMAN_TIMEOUT > 0:
+        scheduler.schedule(('deadman', sid), DEADMAN_TIMEOUT, lambda: deadman_expired(sid))
+
+def deadman_expired(sid):
+    """ハートビートが途絶えたクライアントの走行を停止"""
+    if current_direction != 0 or motor_mailbox.target not in (None, (0, 0)):
+        event_log.warning('deadman', 'ハートビートが途絶えたためモーターを停止します', sid=sid)
     stop_motors()
+    sequence_player.abort_for(sid, 'deadman')
+
+class ActuatorMailbox:
+    """
+    アクチュエータ1つ分のメールボックス
+    要求された目標値は最新の1つだけを保持し（latest-wins）、
+    更新ループが前回反映した値から変わっている場合だけハードウェアに反映する
+    apply(target, source) はハードウェアに書き込めた場合にTrueを返す
+    （書き込めなかった目標値は反映済みとせず、次の周期で再び書き込む）
+    """
+    def __init__(self, name, apply):
+        self.name = name
+        self._apply = apply
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._target = None
+        self._source = None
+        self._applied = None
+
+    @property
+    def target(self):
+        """最新の目標値（未設定ならNone）"""
+        with self._lock:
+            return self._target
+
+    def post(self, target, source=None):
+        """目標値を置き換える（ハードウェアには触れない）"""
+        with self._lock:
+            self._target = target
+            self._source = source
+
+    def flush(self):
+        """
+        目標値が変わっていればハードウェアに反映する
+        return: 反映した場合True
+        """
+        with self._apply_lock:
+            with self._lock:
+                target, source = self._target, self._source
+            if target is None or target == self._applied:
+                command_latency.discard(self.name)
+                return False
+            if not self._apply(target, source):
+                return False
+            self._applied = target
+            return True
+
+    def invalidate(self):
+        """反映済みの値を忘れ、次の周期で目標値を書き込み直させる（pigpioの再接続時）"""
+        with self._apply_lock:
+            self._applied = None
+
+class ServoAxis:
+    """
+    サーボ1軸分のモーションプランナー
+    最大角速度・最大角加速度の範囲で現在角度を目標角度へ補間する（台形速度プロファイル）
+    目標は動作中でも置き換えられ、更新ループのstepだけがハードウェアに触れる
+    """
+    def __init__(self, name, pin, angle=90, max_velocity=SERVO_MAX_VELOCITY,
+                 max_acceleration=SERVO_MAX_ACCELERATION):
+        self.name = name
+        self.pin = pin
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self._lock = threading.Lock()
+        # サーボ信号の送信を直列化する（_lockとは別にし、set_targetをpigpioの往復で待たせない）
+        self._write_lock = threading.Lock()
+        self._position = float(angle)
+        self._velocity = 0.0
+        self._target = float(angle)
+        self._source = None
+        self._pulse = None
+
+    def set_target(self, angle, source=None):
+        """目標角度を置き換える（ブロックしない）"""
+        target = float(max(0, min(180, angle)))
+        with self._lock:
+            self._target = target
+            self._source = source
+        telemetry.update(**{self.name: round(target)})
+
+    def move_now(self, angle):
+        """補間せずに即座に角度を反映（初期化・終了処理用）"""
+        target = float(max(0, min(180, angle)))
+        with self._lock:
+            self._position = self._target = target
+            self._velocity = 0.0
+        self._write(target)
+        telemetry.update(**{self.name: round(target)})
+
+    def step(self, dt):
+        """
+        dt秒分だけ目標に向けて動かす
+        return: このステップで目標に到達した場合True
+        """
+        with self._lock:
+            error = self._target - self._position
+            if error == 0 and self._velocity == 0 and self._pulse is not None:
+                command_latency.discard(self.name)
+                return False
+            
+            # 十分近づいていて1ステップ分の減速で止まれる速度なら目標で止める
+            dv = self.max_acceleration * dt
+            arrived = abs(error) <= max(0.05, dv * dt) and abs(self._velocity) <= dv
+            if arrived:
+                self._position = self._target
+                self._velocity = 0.0
+            else:
+                # 残り距離で止まれる速度を上限に、加速度制限付きで速度を更新
+                # （1ステップごとにdvずつ減速して止まれる速度: v^2 + v*dv <= 2*a*残り距離）
+                # 目標が停止距離の内側に置き換えられて通り過ぎた場合も、加速度制限の範囲で減速して戻る
+                direction = 1.0 if error > 0 else -1.0
+                stop_velocity = (math.sqrt(dv * dv + 8 * self.max_acceleration * abs(error)) - dv) / 2
+                desired = direction * min(self.max_velocity, stop_velocity)
+                self._velocity += max(-dv, min(dv, desired - self._velocity))
+                self._position += self._velocity * dt
+            position = self._position
+        self._write(position)
+        return arrived
+
+    def _write(self, position):
+        """
+        パルス幅が変わった場合だけサーボ信号を送る（_lockの外で呼ぶ）
+        端の近くで通り過ぎた分は可動範囲の端の角度で出力する
+        """
+        angle = max(0.0, min(180.0, position))
+        pulse = int(round(angle_to_pulse_width(angle)))
+        with self._write_lock:
+            if pulse != self._pulse:
+                command_latency.actuated(self.name)
+                set_servo_angle(self.pin, angle)
+                self._pulse = pulse
+
+    def invalidate(self):
+        """送信済みのパルス幅を忘れ、次のstepで現在角度を送り直させる（pigpioの再接続時）"""
+        with self._write_lock:
+            self._pulse = None
+
+    def eta(self):
+        """目標到達までの推定時間（秒）"""
+        with self._lock:
+            distance = abs(self._target - self._position)
+            if distance == 0:
+                return 0.0
+            a = self.max_acceleration
+            v_max = self.max_velocity
+            # 目標方向への速度（逆向きに動いている場合は負）
+            u = self._velocity if self._target > self._position else -self._velocity
+        
+        eta = 0.0
+        if u < 0:
+            # まず停止してから向きを変える
+            eta += -u / a
+            distance += u * u / (2 * a)
+            u = 0.0
+        accel_distance = (v_max * v_max - u * u) / (2 * a)
+        decel_distance = v_max * v_max / (2 * a)
+        if accel_distance + decel_distance <= distance:
+            eta += (v_max - u) / a + (distance - accel_distance - decel_distance) / v_max + v_max / a
+        else:
+            peak = max(u, math.sqrt((2 * a * distance + u * u) / 2))
+            eta += (peak - u) / a + peak / a
+        return eta
+
+    def status(self):
+        """現在角度・目標角度・速度・到達予定時間"""
+        with self._lock:
+            current, target, velocity = self._position, self._target, self._velocity
+        return {
+            'current': round(current, 1),
+            'target': round(target, 1),
+            'velocity': round(velocity, 1),
+            'eta': round(self.eta(), 3)
+        }
+
+def apply_motors(target, source):
+    """モーターに (速度, 方向) を反映"""
+    speed, direction = target
+    return move_motors(speed, direction)
+
+motor_mailbox = ActuatorMailbox('motors', apply_motors)
+actuator_mailboxes = [motor_mailbox]
+
+pitch_axis = ServoAxis('pitch', SERVO_PITCH, current_pitch)
+yaw_axis = ServoAxis('yaw', SERVO_YAW, current_yaw)
+servo_axes = {'pitch': pitch_axis, 'yaw': yaw_axis}
+
+def get_servo_motion_status():
+    """各軸の現在角度・目標角度・到達予定時間"""
+    return {name: axis.status() for name, axis in servo_axes.items()}
+
+def actuator_loop():
+    """
+    ACTUATOR_RATE_HZ周期で各メールボックスの目標値をハードウェアに反映し、
+    サーボを目標角度に向けて補間するループ
+    """
+    interval = 1.0 / ACTUATOR_RATE_HZ
+    next_tick = time.monotonic()
+    last_step = next_tick
+    
+    while True:
+        for mailbox in actuator_mailboxes:
+            try:
+                mailbox.flush()
+            except Exception as e:
+                event_log.error('actuator_error', 'アクチュエータ更新エラー', actuator=mailbox.name, error=str(e))
+        # サーボは実際の経過時間で補間する（ループが遅れても角速度・角加速度を守る）
+        # 長く止まっていた場合に1ステップで大きく動かないよう周期の数倍までに抑える
+        now = time.monotonic()
+        dt = min(now - last_step, interval * 5)
+        last_step = now
+        for axis in servo_axes.values():
+            try:
+                axis.step(dt)
+            except Exception as e:
+                event_log.error('actuator_error', 'サーボ更新エラー', actuator=axis.name, error=str(e))
+        
+        next_tick += interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # 処理が周期に間に合わなかった場合は遅れを取り戻そうとしない
+            next_tick = time.monotonic()
+
+def sequence_number(value, low, high, label):
+    """キーフレームの数値を検証する（数値でない・範囲外ならValueError）"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+        raise ValueError(f'{label}が不正です: {value!r}（{low}〜{high}の数値）')
+    return value
+
+def parse_sequence(steps):
+    """
+    シーケンスのキーフレームを検証して時刻順に並べる
+    キーフレーム: {'at': 開始からの秒数,
+                   'motor': {'action': 'forward' | 'backward' | 'left' | 'right' | 'stop', 'speed': 0-100},
+                   'servo': {'pitch': 角度, 'yaw': 角度},
+                   'led': led_controlと同じ形式}（motor・servo・ledは少なくとも1つ）
+    不正な場合はValueError
+    """
+    if not isinstance(steps, list) or not steps:
+        raise ValueError('キーフレームがありません')
+    if len(steps) > SEQUENCE_MAX_STEPS:
+        raise ValueError(f'キーフレームが多すぎます（最大{SEQUENCE_MAX_STEPS}）')
+    
+    parsed = []
+    for number, step in enumerate(steps):
+        if not isinstance(step, dict):
+            raise ValueError(f'キーフレーム{number}: 形式が不正です')
+        prefix = f'キーフレーム{number}: '
+        at = sequence_number(step.get('at'), 0, SEQUENCE_MAX_DURATION, prefix + '時刻')
+        motor, servo, led = step.get('motor'), step.get('servo'), step.get('led')
+        if motor is None and servo is None and led is None:
+            raise ValueError(prefix + 'motor・servo・ledのいずれもありません')
+        for name, value in (('motor', motor), ('servo', servo), ('led', led)):
+            if value is not None and not isinstance(value, dict):
+                raise ValueError(prefix + f'{name}の形式が不正です')
+        
+        if motor is not None:
+            action = motor.get('action')
+            if action == 'stop':
+                motor = (0, 0)
+            elif action in MOTOR_COMMANDS:
+                motor = (sequence_number(motor.get('speed', 50), 0, 100, prefix + '速度'), MOTOR_COMMANDS[action])
+            else:
+                raise ValueError(prefix + f'未知のアクション: {action}')
+        if servo is not None:
+            if not servo or any(name not in servo_axes for name in servo):
+                raise ValueError(prefix + f'未知のサーボ: {list(servo)}')
+            servo = {name: sequence_number(angle, 0, 180, prefix + f'{name}の角度') for name, angle in servo.items()}
+        if led is not None:
+            if led.get('action') not in LED_COMMANDS:
+                raise ValueError(prefix + f'未知のLEDコマンド: {led.get("action")}')
+            # 実行時に失敗しないよう数値は受け取った時点で検証しておく
+            for key in ('r', 'g', 'b'):
+                if key in led:
+                    sequence_number(led[key], 0, 255, prefix + key)
+            if 'brightness' in led:
+                sequence_number(led['brightness'], 0, 100, prefix + '明度')
+            if 'led_index' in led and led['led_index'] not in range(-1, LED_COUNT):
+                raise ValueError(prefix + f'LEDのインデックスが不正です: {led["led_index"]!r}')
+        parsed.append((float(at), motor, servo, led))
+    # 同じ時刻のキーフレームは送られた順に実行する
+    parsed.sort(key=lambda step: step[0])
+    return parsed
+
+class SequencePlayer:
+    """
+    キーフレームのシーケンス（マクロ）をロボット側の単調時計で実行する
+    各キーフレームは開始時刻からの絶対時刻でスケジューラに登録するため、
+    コールバックの遅れは次のキーフレームに積み重ならない（一時停止した時間だけ開始時刻を後ろにずらす）
+    同時に実行できるシーケンスは1つだけで、進行状況は開始したクライアントに送る
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._steps = []
+        self._index = 0
+        self._started = 0.0     # 開始時刻（time.monotonic()）
+        self._paused_at = None
+        self._motor = None      # 最後に実行したモーターのキーフレーム（再開時に戻す）
+        self._errors = []       # キーフレームごとのタイミング誤差（秒）
+        self.owner = None
+        self.name = None
+        self.state = 'idle'     # 'idle' / 'running' / 'paused'
+
+    def run(self, steps, owner, name=None):
+        """シーケンスを開始（実行中・一時停止中はFalse）"""
+        with self._lock:
+            if self.state != 'idle':
+                return False
+            self._steps = steps
+            self._index = 0
+            self._motor = None
+            self._errors = []
+            self.owner = owner
+            self.name = name
+            self.state = 'running'
+            self._started = time.monotonic()
+            self._schedule_next()
+        return True
+
+    def pause(self):
+        """一時停止（走行中のモーターは止め、サーボ・LEDはそのまま）"""
+        with self._lock:
+            if self.state != 'running':
+                return False
+            scheduler.cancel('sequence')
+            self._paused_at = time.monotonic()
+            self.state = 'paused'
+        stop_motors()
+        return True
+
+    def resume(self):
+        """一時停止した位置から再開（止めていたモーターは直前のキーフレームの状態に戻す）"""
+        with self._lock:
+            if self.state != 'paused':
+                return False
+            self._started += time.monotonic() - self._paused_at
+            self._paused_at = None
+            self.state = 'running'
+            motor = self._motor
+            if motor is not None and motor[1] != 0:
+                command_latency.received('motors')
+                motor_mailbox.post(motor)
+                arm_deadman(self.owner)
+            self._schedule_next()
+        return True
+
+    def abort(self, reason='abort'):
+        """
+        中止してモーターを止め、開始したクライアントに通知する
+        return: 開始したクライアントのsid（実行していなかった場合None）
+        """
+        with self._lock:
+            if self.state == 'idle':
+                return None
+            scheduler.cancel('sequence')
+            owner = self.owner
+            status = self._finish('aborted', reason)
+        stop_motors()
+        socketio.emit('sequence_status', status, to=owner)
+        return owner
+
+    def abort_for(self, sid, reason):
+        """sidのクライアントが開始したシーケンスなら中止する（切断・デッドマン用）"""
+        if self.owner == sid:
+            self.abort(reason)
+
+    def _schedule_next(self):
+        """次のキーフレームを登録する（ロックを持って呼ぶ）"""
+        due = self._started + self._steps[self._index][0]
+        scheduler.schedule('sequence', max(0.0, due - time.monotonic()), self._fire)
+
+    def _fire(self):
+        """スケジューラスレッドから呼ばれる: 予定時刻を過ぎたキーフレームをまとめて実行する"""
+        progress = []
+        failed = False
+        with self._lock:
+            if self.state != 'running':
+                return
+            now = time.monotonic()
+            while self._index < len(self._steps):
+                at, motor, servo, led = self._steps[self._index]
+                due = self._started + at
+                if due > now:
+                    break
+                error = now - due
+                try:
+                    self._apply(motor, servo, led)
+                except Exception as e:
+                    # 失敗したキーフレームで中止する（実行中のまま残さない）
+                    event_log.error('sequence_control', 'キーフレームの実行に失敗しました', step=self._index, error=str(e))
+                    failed = True
+                    break
+                self._errors.append(error)
+                sequence_step_error_seconds.observe(error)
+                self._index += 1
+                progress.append({'step': self._index - 1, 'count': len(self._steps), 'at': at,
+                                 'error_ms': round(error * 1000, 3)})
+                now = time.monotonic()
+            owner = self.owner
+            if failed:
+                status = self._finish('aborted', f'キーフレーム{self._index}の実行に失敗しました')
+            elif self._index < len(self._steps):
+                self._schedule_next()
+                status = None
+            else:
+                status = self._finish('finished')
+        
+        if failed:
+            stop_motors()
+        for item in progress:
+            socketio.emit('sequence_progress', item, to=owner)
+        if status is not None:
+            socketio.emit('sequence_status', status, to=owner)
+
+    def _apply(self, motor, servo, led):
+        """キーフレーム1つを各アクチュエータに反映する（ハードウェアへの書き込みは更新ループ・レンダースレッド）"""
+        global current_pitch, current_yaw
+        if motor is not None:
+            command_latency.received('motors')
+            motor_mailbox.post(motor)
+            self._motor = motor
+            if motor[1] != 0:
+                # 開始したクライアントのハートビートが途絶えたらデッドマンで停止する
+                arm_deadman(self.owner)
+        if servo is not None:
+            for name, angle in servo.items():
+                command_latency.received(name)
+                servo_axes[name].set_target(angle, 'sequence')
+            current_pitch = servo.get('pitch', current_pitch)
+            current_yaw = servo.get('yaw', current_yaw)
+        if led is not None:
+            command_latency.received('leds')
+            apply_led_command(led)
+
+    def _finish(self, state, reason=None):
+        """終了状態を作って待機状態に戻す（ロックを持って呼ぶ）"""
+        status = dict(self._status(), state=state,
+                      errors_ms=[round(error * 1000, 3) for error in self._errors])
+        if reason:
+            status['reason'] = reason
+        self.state = 'idle'
+        self.owner = None
+        self._paused_at = None
+        return status
+
+    def _status(self):
+        errors = self._errors
+        if self.state == 'idle':
+            elapsed = 0.0
+        else:
+            elapsed = (self._paused_at or time.monotonic()) - self._started
+        return {
+            'name': self.name,
+            'state': self.state,
+            'step': self._index,
+            'count': len(self._steps),
+            'elapsed': round(elapsed, 3),
+            'duration': self._steps[-1][0] if self._steps else 0.0,
+            'error_ms_mean': round(sum(errors) / len(errors) * 1000, 3) if errors else None,
+            'error_ms_max': round(max(errors) * 1000, 3) if errors else None
+        }
+
+    def status(self):
+        """実行状態とタイミング誤差の統計"""
+        with self._lock:
+            return self._status()
+
+sequence_player = SequencePlayer()
 
 @app.route('/')
 def index():
@@ -423,209 +2351,502 @@ def desktop():
 
 @app.route('/video_feed')
 def video_feed():
-    """ビデオストリーミング"""
-    return Response(generate_video_stream(),
+    """
+    ビデオストリーミング
+    ?profile=full/half/low でレンディションを選択、?max_fps=N でクライアントごとの最大フレームレートを指定
+    """
+    profile = request.args.get('profile', DEFAULT_STREAM_PROFILE)
+    rendition = stream_renditions.get(profile)
+    if rendition is None:
+        return f'未知のプロファイル: {profile}', 400
+    max_fps = request.args.get('max_fps', type=float)
+    if max_fps is not None and max_fps <= 0:
+        return f'max_fpsは正の値を指定してください: {max_fps}', 400
+    
+    limit_send_buffer(request.environ)
+    client = StreamClient(rendition, max_fps)
+    return Response(generate_video_stream(rendition, client),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/replay')
+def replay():
+    """
+    タイムシフト再生
+    ?seconds=T でT秒前から、?speed=S でS倍速で再生する（最新に追いついた後はライブ）
+    """
+    if timeshift.rendition is None:
+        return 'タイムシフトは無効です', 404
+    seconds_ago = request.args.get('seconds', 10.0, type=float)
+    speed = request.args.get('speed', 1.0, type=float)
+    if not 0 <= seconds_ago <= timeshift.seconds:
+        return f'secondsは0から{timeshift.seconds}の範囲で指定してください: {seconds_ago}', 400
+    if not 0 < speed <= REPLAY_MAX_SPEED:
+        return f'speedは0より大きく{REPLAY_MAX_SPEED}以下で指定してください: {speed}', 400
+    
+    limit_send_buffer(request.environ)
+    return Response(generate_replay_stream(seconds_ago, speed),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/snapshot.jpg')
+def snapshot():
+    """
+    最新フレームを1枚のJPEGとして返す（ETag / If-None-Match で未更新なら304）
+    ?profile=名前 でレンディションを選択
+    """
+    profile = request.args.get('profile', DEFAULT_STREAM_PROFILE)
+    rendition = stream_renditions.get(profile)
+    if rendition is None:
+        return f'未知のプロファイル: {profile}', 400
+    
+    sequence, frame, captured_at = rendition.broker.latest()
+    if frame is None or time.time() - captured_at > SNAPSHOT_MAX_AGE:
+        # エンコードが止まっているレンディションは1枚分だけ視聴者として待つ
+        rendition.broker.add_viewer()
+        try:
+            _, fresh, fresh_captured_at = rendition.broker.wait_for_frame(sequence, timeout=SNAPSHOT_WAIT_TIMEOUT)
+        finally:
+            rendition.broker.remove_viewer()
+        if fresh is not None:
+            frame, captured_at = fresh, fresh_captured_at
+    if frame is None:
+        return 'フレームを取得できません', 503
+    
+    response = Response(frame.jpeg, mimetype='image/jpeg')
+    response.set_etag(f'{profile}-{int(captured_at * 1000)}')
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def collect_stream_metrics():
+    """スクレイプ時に配信の状態をメトリクスに写す"""
+    capture_fps.expire()
+    for name, rendition in stream_renditions.items():
+        frames_published.set(rendition.broker.latest()[0], rendition=name)
+        encoder_dropped.set(rendition.encoder.dropped, rendition=name)
+    
+    stream_client_lag.clear()
+    stream_client_dropped.clear()
+    for client in list(stream_clients.values()):
+        labels = {'client': client.id, 'rendition': client.rendition, 'transport': 'http'}
+        stream_client_lag.set(client.lag, **labels)
+        stream_client_dropped.set(client.frames_dropped, **labels)
+    for subscriber in list(socket_video_subscribers.values()):
+        labels = {'client': subscriber.sid, 'rendition': subscriber.rendition.name, 'transport': 'socketio'}
+        stream_client_dropped.set(subscriber.frames_dropped, **labels)
+
+metrics.add_collector(collect_stream_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheusテキスト形式のメトリクス（METRICS=0 の場合は404）"""
+    if not metrics.enabled:
+        return 'メトリクスは無効です', 404
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/health')
+def health():
+    """サブシステムごとの状態（いずれかがready以外なら503）"""
+    status = {name: subsystem.status() for name, subsystem in subsystems.items()}
+    ready = all(item['state'] == 'ready' for item in status.values())
+    return jsonify(subsystems=status, first_command_seconds=first_command_seconds), 200 if ready else 503
+
+@app.route('/stream_status')
+def stream_status():
+    """映像配信の状態（active/idle）と視聴者数"""
+    return jsonify(get_stream_status())
+
+def record_first_command(event):
+    """起動から最初の制御コマンドを受信するまでの時間を記録する"""
+    global first_command_seconds
+    first_command_seconds = round(time.monotonic() - boot_started, 3)
+    startup_seconds.set(first_command_seconds, phase='first_command')
+    event_log.info('first_command', '最初の制御コマンドを受信しました', command=event, seconds=first_command_seconds)
+
+def socket_event(event):
+    """socketio.on と同じだが、イベントの受信数をメトリクスに数え、制御コマンドはトレースに記録する"""
+    traced = event in TRACE_EVENTS
+    control = event in CONTROL_EVENTS
+    def decorator(handler):
+        @functools.wraps(handler)
+        def counted(*args):
+            socketio_events.inc(event=event)
+            if control and VIDEO_ONLY:
+                emit('error', {'message': 'このサーバーは映像配信専用です（制御は制御サーバーに接続してください）'})
+                return
+            if traced:
+                command_trace.record(request.sid, event, args[0] if args else None)
+                if first_command_seconds is None:
+                    record_first_command(event)
+            return handler(*args)
+        return socketio.on(event)(counted)
+    return decorator
+
 @socketio.on('connect')
 def handle_connect():
     """クライアント接続時"""
-    print('クライアントが接続しました')
-    emit('status', {'action': '接続完了', 'speed': 0})
+    event_log.info('connect', 'クライアントが接続しました', sid=request.sid)
+    # 新しいクライアントには全状態を1回だけ送り、以降は差分を配信する
+    emit('telemetry', dict(telemetry.snapshot(), full=True))
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """クライアント切断時"""
-    print('クライアントが切断しました')
-    stop_motors()
+    event_log.info('disconnect', 'クライアントが切断しました', sid=request.sid)
+    stop_socket_video(request.sid)
+    if not VIDEO_ONLY:
+        sequence_player.abort_for(request.sid, 'disconnect')
+        scheduler.cancel(('deadman', request.sid))
+        stop_motors()
+
+@socket_event('video_subscribe')
+def handle_video_subscribe(data=None):
+    """Socket.IO経由のバイナリ映像配信を開始"""
+    data = data or {}
+    profile = data.get('profile', DEFAULT_STREAM_PROFILE)
+    rendition = stream_renditions.get(profile)
+    if rendition is None:
+        emit('error', {'message': f'未知のプロファイル: {profile}'})
+        return
+    try:
+        window = int(data.get('window', SOCKET_VIDEO_WINDOW))
+    except (ValueError, TypeError):
+        emit('error', {'message': f"windowが不正です: {data.get('window')!r}"})
+        return
+    window = max(1, min(SOCKET_VIDEO_MAX_WINDOW, window))
+    
+    # 同じクライアントの既存の配信は置き換える
+    stop_socket_video(request.sid)
+    subscriber = SocketVideoSubscriber(request.sid, rendition, window)
+    with socket_video_lock:
+        socket_video_subscribers[request.sid] = subscriber
+    socketio.start_background_task(push_socket_video, subscriber)
+    
+    event_log.info('video_subscribe', 'Socket.IO映像配信開始', profile=profile, window=subscriber.window)
+    emit('video_status', {'action': 'subscribed', 'profile': profile, 'window': subscriber.window})
+
+@socket_event('recording_control')
+def handle_recording_control(data):
+    """録画の開始・停止 {'action': 'start' | 'stop', 'profile': レンディション名（省略可）}"""
+    action = data.get('action')
+    if action == 'start':
+        profile = data.get('profile', RECORDING_PROFILE)
+        rendition = stream_renditions.get(profile)
+        if rendition is None:
+            emit('error', {'message': f'未知のプロファイル: {profile}'})
+            return
+        if recorder.start(rendition):
+            event_log.info('recording_control', '録画開始', profile=profile, directory=recorder.directory)
+    elif action == 'stop':
+        if recorder.stop():
+            event_log.info('recording_control', '録画停止')
+    else:
+        emit('error', {'message': f'未知の録画操作: {action}'})
+        return
+    emit('recording_status', recorder.status())
+
+@socket_event('trace_control')
+def handle_trace_control(data):
+    """制御コマンドのトレース記録の開始・停止 {'action': 'start' | 'stop' | 'status'}"""
+    action = data.get('action')
+    if action == 'start':
+        if command_trace.start():
+            event_log.info('trace_control', 'トレース記録開始', path=command_trace.path)
+    elif action == 'stop':
+        if command_trace.stop():
+            event_log.info('trace_control', 'トレース記録停止', path=command_trace.path)
+    elif action != 'status':
+        emit('error', {'message': f'未知のトレース操作: {action}'})
+        return
+    emit('trace_status', command_trace.status())
+
+@socket_event('sequence_control')
+def handle_sequence_control(data):
+    """
+    キーフレームシーケンスの操作
+    {'action': 'run', 'steps': [キーフレーム, ...], 'name': 名前（省略可）} | {'action': 'pause' | 'resume' | 'abort' | 'status'}
+    実行中は 'sequence_progress'（キーフレームごとのタイミング誤差）、終了・中止時に 'sequence_status' を送る
+    """
+    action = data.get('action')
+    if action == 'run':
+        try:
+            steps = parse_sequence(data.get('steps'))
+        except ValueError as e:
+            emit('error', {'message': f'シーケンスが不正です: {e}'})
+            return
+        if not sequence_player.run(steps, request.sid, data.get('name')):
+            emit('error', {'message': '別のシーケンスを実行中です'})
+            return
+        event_log.info('sequence_control', 'シーケンス開始', name=data.get('name'), steps=len(steps))
+    elif action == 'pause':
+        sequence_player.pause()
+    elif action == 'resume':
+        sequence_player.resume()
+    elif action == 'abort':
+        owner = sequence_player.abort()
+        if owner is not None:
+            event_log.info('sequence_control', 'シーケンス中止')
+        if owner == request.sid:
+            return
+    elif action != 'status':
+        emit('error', {'message': f'未知のシーケンス操作: {action}'})
+        return
+    emit('sequence_status', sequence_player.status())
+
+@socket_event('vision_control')
+def handle_vision_control(data):
+    """
+    フレームプロセッサーの設定 {'action': 'configure', 'processor': 名前, 設定...} | {'action': 'status'}
+    設定の例: {'enabled': True, 'every': 3, 'budget': 0.01, 'lower': [150, 0, 0], 'upper': [255, 90, 90], 'auto_aim': True}
+    """
+    action = data.get('action')
+    if action == 'configure':
+        name = data.get('processor')
+        processor = vision_stage.get(name)
+        if processor is None:
+            emit('error', {'message': f'未知のプロセッサー: {name}'})
+            return
+        options = {key: value for key, value in data.items() if key not in ('action', 'processor')}
+        try:
+            processor.configure(**options)
+        except (ValueError, TypeError) as e:
+            emit('error', {'message': f'プロセッサーの設定が不正です: {e}'})
+            return
+        # 有効にした場合、休止中のキャプチャスレッドは次の確認（最大1秒後）で再開する
+        event_log.info('vision_control', 'フレーム解析の設定を変更', processor=name, **options)
+    elif action != 'status':
+        emit('error', {'message': f'未知のフレーム解析操作: {action}'})
+        return
+    emit('vision_status', vision_stage.status())
+
+@socket_event('vision_subscribe')
+def handle_vision_subscribe():
+    """フレーム解析の結果の配信ルームに参加"""
+    join_room(VISION_ROOM)
+
+@socket_event('vision_unsubscribe')
+def handle_vision_unsubscribe():
+    """フレーム解析の結果の配信ルームから退出"""
+    leave_room(VISION_ROOM)
+
+@socket_event('video_ack')
+def handle_video_ack(data):
+    """受信済みフレームの確認（フロー制御）"""
+    subscriber = socket_video_subscribers.get(request.sid)
+    if subscriber:
+        subscriber.acknowledge(data.get('seq', 0))
+
+@socket_event('video_unsubscribe')
+def handle_video_unsubscribe():
+    """Socket.IO経由の映像配信を停止"""
+    stop_socket_video(request.sid)
+    emit('video_status', {'action': 'unsubscribed'})
+
+@socket_event('telemetry_subscribe')
+def handle_telemetry_subscribe():
+    """テレメトリ差分の配信ルームに参加"""
+    if TELEMETRY_ROOM:
+        join_room(TELEMETRY_ROOM)
 
-@socketio.on('motor_control')
+@socket_event('telemetry_unsubscribe')
+def handle_telemetry_unsubscribe():
+    """テレメトリ差分の配信ルームから退出"""
+    if TELEMETRY_ROOM:
+        leave_room(TELEMETRY_ROOM)
+
+@socket_event('motor_control')
 def handle_motor_control(data):
     """モーター制御コマンドを受信"""
-    global move_timer
-    
     action = data.get('action')
     speed = data.get('speed', 50)  # デフォルト速度50%
     duration = data.get('duration', 0)  # 継続時間（0=無制限）
     
-    print(f"受信コマンド: {action}, 速度: {speed}%, 継続時間: {duration}秒")
-    
-    # 既存のタイマーをキャンセル
-    if move_timer:
-        move_timer.cancel()
-    
-    # アクションに応じてモーターを制御
-    if action == 'forward':
-        move_motors(speed, 1)
-    elif action == 'backward':
-        move_motors(speed, -1)
-    elif action == 'left':
-        move_motors(speed, -2)
-    elif action == 'right':
-        move_motors(speed, 2)
+    event_log.info('motor_control', '受信コマンド', action=action, speed=speed, duration=duration)
+    
+    command_latency.received('motors')
+    
+    # 既存の自動停止をキャンセル
+    scheduler.cancel('motor_auto_stop')
+    
+    # アクションに応じてモーターの目標値を更新（反映は更新ループで行う）
+    if action in MOTOR_COMMANDS:
+        motor_mailbox.post((speed, MOTOR_COMMANDS[action]))
     elif action == 'stop':
         stop_motors()
+        scheduler.cancel(('deadman', request.sid))
+        return
     else:
+        command_latency.discard('motors')
         emit('error', {'message': f'未知のアクション: {action}'})
         return
     
-    # 継続時間が指定されている場合、タイマーで自動停止
+    # 走行中はハートビートが途絶えたら停止する
+    arm_deadman(request.sid)
+    
+    # 継続時間が指定されている場合、スケジューラで自動停止
     if duration > 0:
-        move_timer = threading.Timer(duration, auto_stop)
-        move_timer.start()
+        scheduler.schedule('motor_auto_stop', duration, auto_stop)
+
+@socket_event('heartbeat')
+def handle_heartbeat():
+    """クライアントの生存通知（走行中のみデッドマンタイマーを延長）"""
+    if scheduler.is_scheduled(('deadman', request.sid)):
+        arm_deadman(request.sid)
 
-@socketio.on('get_status')
+@socket_event('get_status')
 def handle_get_status():
-    """現在の状態を返す"""
-    emit('status', {
-        'speed': current_speed,
-        'direction': current_direction,
-        'connected': pi.connected if pi else False
-    })
-    emit('servo_status', {
-        'pitch': current_pitch,
-        'yaw': current_yaw
-    })
-
-@socketio.on('servo_control')
+    """現在の状態を返す（全状態のスナップショットと診断情報）"""
+    emit('telemetry', dict(
+        telemetry.snapshot(),
+        full=True,
+        connected=pi.connected if pi else False,
+        motor_command_rtt=motor_command_rtt_stats,
+        subsystems={name: subsystem.status() for name, subsystem in subsystems.items()},
+        servo_motion=get_servo_motion_status()
+    ))
+
+@socket_event('servo_control')
 def handle_servo_control(data):
     """サーボモーター制御コマンドを受信"""
     servo_type = data.get('type')  # 'pitch' または 'yaw'
     direction = data.get('direction')  # 'up', 'down', 'left', 'right', 'center'
     
-    print(f"サーボ制御コマンド: {servo_type}, 方向: {direction}")
+    event_log.info('servo_control', 'サーボ制御コマンド', type=servo_type, direction=direction)
     
     if servo_type in ['pitch', 'yaw'] and direction in ['up', 'down', 'left', 'right', 'center']:
+        command_latency.received(servo_type)
         control_servo(servo_type, direction)
     else:
         emit('error', {'message': f'未知のサーボコマンド: {servo_type}, {direction}'})
 
-@socketio.on('servo_angle')
+@socket_event('servo_angle')
 def handle_servo_angle(data):
-    """サーボモーターの角度直接指定"""
+    """
+    サーボモーターの角度直接指定
+    スライダー操作で大量に届くため、目標値の更新だけを行い反映は更新ループに任せる
+    """
     global current_pitch, current_yaw
     
     servo_type = data.get('type')  # 'pitch' または 'yaw'
     angle = data.get('angle', 90)  # 角度（0-180）
     
-    print(f"サーボ角度設定: {servo_type}, 角度: {angle}度")
-    
     # 角度を0-180度の範囲に制限
     angle = max(0, min(180, angle))
+    event_log.debug('servo_angle', 'サーボ角度指定', type=servo_type, angle=angle)
     
     if servo_type == 'pitch':
+        command_latency.received('pitch')
         current_pitch = angle
-        set_servo_angle(SERVO_PITCH, current_pitch)
-        socketio.emit('servo_status', {
-            'type': 'pitch', 
-            'angle': current_pitch,
-            'direction': 'slider'
-        })
+        pitch_axis.set_target(current_pitch, 'slider')
     elif servo_type == 'yaw':
+        command_latency.received('yaw')
         current_yaw = angle
-        set_servo_angle(SERVO_YAW, current_yaw)
-        socketio.emit('servo_status', {
-            'type': 'yaw',
-            'angle': current_yaw,
-            'direction': 'slider'
-        })
+        yaw_axis.set_target(current_yaw, 'slider')
     else:
         emit('error', {'message': f'未知のサーボタイプ: {servo_type}'})
 
-@socketio.on('led_control')
+@socket_event('led_control')
 def handle_led_control(data):
     """LED制御コマンドを受信"""
     action = data.get('action')
     
-    print(f"LED制御コマンド: {action}")
+    event_log.info('led_control', 'LED制御コマンド', action=action)
+    command_latency.received('leds')
     
-    if action == 'set_color':
-        led_index = data.get('led_index', -1)  # -1で全LED
-        r = data.get('r', 0)
-        g = data.get('g', 0)
-        b = data.get('b', 0)
-        set_led_color(led_index, r, g, b)
-        socketio.emit('led_status', {
-            'action': 'color_set',
-            'led_index': led_index,
-            'r': r, 'g': g, 'b': b
-        })
+    if not apply_led_command(data):
+        command_latency.discard('leds')
+        emit('error', {'message': f'未知のLEDコマンド: {action}'})
+
+def start_workers():
+    """バックグラウンドのスレッドを開始（ハードウェアの初期化後に呼ぶ、映像配信専用では映像のみ）"""
+    if not VIDEO_ONLY:
+        # LEDレンダースレッドを開始
+        led_thread = threading.Thread(target=led_engine.run, daemon=True)
+        led_thread.start()
         
-    elif action == 'set_brightness':
-        brightness = data.get('brightness', 100)
-        set_led_brightness(brightness)
+        # テレメトリ配信スレッドを開始
+        telemetry_thread = threading.Thread(target=telemetry_loop, daemon=True)
+        telemetry_thread.start()
         
-    elif action == 'animation_rainbow':
-        stop_led_animation()
-        threading.Thread(target=led_animation_rainbow, daemon=True).start()
-        socketio.emit('led_status', {'action': 'animation_started', 'type': 'rainbow'})
-        
-    elif action == 'animation_chase':
-        r = data.get('r', 255)
-        g = data.get('g', 0)
-        b = data.get('b', 0)
-        stop_led_animation()
-        threading.Thread(target=led_animation_chase, args=(r, g, b), daemon=True).start()
-        socketio.emit('led_status', {'action': 'animation_started', 'type': 'chase'})
-        
-    elif action == 'off':
-        stop_led_animation()
-        set_led_color(-1, 0, 0, 0)  # 全LED消灯
-        socketio.emit('led_status', {'action': 'off'})
+        # 期限管理スケジューラを開始
+        scheduler_thread = threading.Thread(target=scheduler.run, daemon=True)
+        scheduler_thread.start()
         
+        # アクチュエータ更新ループを開始
+        actuator_thread = threading.Thread(target=actuator_loop, daemon=True)
+        actuator_thread.start()
+    
+    # カメラフレーム取得スレッドを開始
+    if CAPTURE_SOURCE == 'shm':
+        for rendition in stream_renditions.values():
+            threading.Thread(target=read_frame_ring, args=(rendition,), daemon=True).start()
     else:
-        emit('error', {'message': f'未知のLEDコマンド: {action}'})
+        camera_thread = threading.Thread(target=capture_frames, daemon=True)
+        camera_thread.start()
 
 def cleanup():
     """終了時のクリーンアップ処理"""
-    global pi, strip, camera
-    
+    sequence_player.abort('shutdown')
     if pi:
         # モーターを停止
         stop_motors()
         # サーボモーターを中央位置に戻す
-        set_servo_angle(SERVO_PITCH, 90)
-        set_servo_angle(SERVO_YAW, 90)
+        pitch_axis.move_now(90)
+        yaw_axis.move_now(90)
         time.sleep(0.5)  # サーボが動く時間を確保
+        if motor_script_id is not None:
+            pi.delete_script(motor_script_id)
         pi.stop()
         print("pigpio終了処理完了")
     if strip:
+        led_engine.stop_animation()
         # 全LEDを消灯
         for i in range(LED_COUNT):
             strip.setPixelColor(i, Color(0, 0, 0))
         strip.show()
         print("NeoPixel LED終了処理完了")
+    if recorder.stop():
+        print("録画を停止しました")
+    if command_trace.stop(timeout=1.0):
+        print(f"トレースを保存しました: {command_trace.path}")
+    for rendition in stream_renditions.values():
+        rendition.encoder.shutdown()
     if camera:
-        camera.stop()
+        if camera_running:
+            camera.stop()
         camera.close()
         print("カメラ終了処理完了")
+    event_log.flush()
 
 if __name__ == '__main__':
     try:
-        # pigpio初期化
-        if not init_pigpio():
-            print("pigpioの初期化に失敗しました")
-            exit(1)
-        
-        # NeoPixel LED初期化
-        if not init_neopixel():
-            print("NeoPixel LEDの初期化に失敗しました")
-            exit(1)
-        
-        # カメラ初期化
-        if not init_camera():
-            print("カメラの初期化に失敗しました")
-            exit(1)
-        
-        # カメラフレーム取得スレッドを開始
-        camera_thread = threading.Thread(target=capture_frames, daemon=True)
-        camera_thread.start()
+        # pigpio・NeoPixel LED・カメラを並行して初期化（失敗したものは縮退状態でバックグラウンドで再試行）
+        for subsystem in subsystems.values():
+            subsystem.start()
+        
+        # 各ワーカーは初期化前のハードウェアがない状態でも動作する
+        start_workers()
+        
+        # 制御経路の準備ができ次第サーバーを開始する（カメラやLEDの初期化は待たない）
+        if VIDEO_ONLY:
+            print("映像配信専用で起動します（pigpio・NeoPixelは使いません）")
+        elif not subsystems['pigpio'].wait_ready(CONTROL_READY_TIMEOUT):
+            print("pigpioを初期化できないまま開始します（バックグラウンドで再試行します）")
+        server_ready_seconds = round(time.monotonic() - boot_started, 3)
+        startup_seconds.set(server_ready_seconds, phase='server')
+        event_log.info('startup', 'サーバーを開始します', seconds=server_ready_seconds,
+                       **get_health_summary())
+        
+        # タイムシフトバッファへの蓄積を開始
+        if TIMESHIFT_SECONDS > 0:
+            timeshift.start(stream_renditions[TIMESHIFT_PROFILE])
+        
+        if TRACE_AT_STARTUP and command_trace.start():
+            print(f"コマンドトレースを記録します: {command_trace.path}")
         
-        print("Flask-SocketIOサーバーを開始します...")
-        print("ブラウザで http://localhost:5000 にアクセスしてください")
+        print(f"Flask-SocketIOサーバーを開始します（{ASYNC_MODE}モード）...")
+        print(f"ブラウザで http://localhost:{SERVER_PORT} にアクセスしてください")
         
         # Flaskサーバー開始
-        socketio.run(app, debug=False, host='0.0.0.0', port=5000)
+        socketio.run(app, debug=False, host='0.0.0.0', port=SERVER_PORT)
         
     except KeyboardInterrupt:
         print("プログラムが中断されました")
@@ -0,0 +1,7 @@
+"""ベンチマーク用のlibcameraの代替"""
+
+class Transform:
+    def __init__(self, hflip=False, vflip=False, transpose=False):
+        self.hflip = hflip
+        self.vflip = vflip
+        self.transpose = transpose
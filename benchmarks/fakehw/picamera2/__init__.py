@@ -0,0 +1,92 @@
+"""
+ベンチマーク用のPicamera2の代替（合成フレームを生成する）
+FAKE_CAMERA_FPS のフレームレートで、横に動く縦線入りのグラデーションを返す
+FAKE_CAMERA_STATIC=1 の場合は毎回同じ画像を返す（変化検出の計測用）
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+FPS = float(os.environ.get('FAKE_CAMERA_FPS', 30))
+STATIC = os.environ.get('FAKE_CAMERA_STATIC') == '1'
+
+class CaptureRequest:
+    """キャプチャ済みリクエスト（mainストリームのバッファを1つ持つ）"""
+    def __init__(self, buffer):
+        self._buffer = buffer
+
+    def make_array(self, name='main'):
+        return self._buffer.copy()
+
+    def release(self):
+        pass
+
+class MappedArray:
+    """リクエストのバッファをコピーせずに参照する"""
+    def __init__(self, request, stream):
+        self.array = request._buffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+class Picamera2:
+    def __init__(self, camera_num=0):
+        self._size = (640, 480)
+        self._lock = threading.Lock()
+        self._buffer = None
+        self._background = None
+        self._next_frame = 0.0
+        self.started = False
+        self.frames = 0
+
+    def create_video_configuration(self, main=None, transform=None, **kwargs):
+        return {'main': dict(main or {}), 'transform': transform}
+
+    def configure(self, config):
+        self._size = tuple(config['main'].get('size', self._size))
+        width, height = self._size
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        y = np.linspace(0, 255, height, dtype=np.uint8)
+        self._background = np.empty((height, width, 3), dtype=np.uint8)
+        self._background[:, :, 0] = x
+        self._background[:, :, 1] = y[:, None]
+        self._background[:, :, 2] = 96
+        self._buffer = self._background.copy()
+
+    def start(self):
+        self.started = True
+        self._next_frame = time.monotonic()
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.started = False
+
+    def _wait_for_frame(self):
+        """次のフレームの時刻まで待ってバッファを更新する（センサーの読み出し相当）"""
+        with self._lock:
+            delay = self._next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame = max(self._next_frame + 1.0 / FPS, time.monotonic())
+            self.frames += 1
+            if not STATIC:
+                np.copyto(self._buffer, self._background)
+                column = (self.frames * 4) % self._size[0]
+                self._buffer[:, column:column + 4] = 255
+
+    def capture_array(self, name='main'):
+        self._wait_for_frame()
+        return self._buffer.copy()
+
+    @contextmanager
+    def captured_request(self):
+        self._wait_for_frame()
+        yield CaptureRequest(self._buffer)
@@ -0,0 +1,143 @@
+"""
+ベンチマーク用のpigpioの代替（ハードウェア不要）
+本物のクライアントと同じくpigpiodとのTCP接続（ここではループバック上の模擬デーモン）を1本開き、
+各コマンドを16バイトの要求・応答の往復で送る（デーモンはFAKE_PIGPIO_LATENCY秒待ってから応答する）
+1本の接続を共有するため、コマンドは直列に処理される
+ソケットを開いたスレッド（geventではハブ）以外から使えないといった本物の制約もそのまま再現される
+"""
+import os
+import socket
+import struct
+import threading
+import time
+
+INPUT = 0
+OUTPUT = 1
+PI_SCRIPT_INITING = 0
+PI_SCRIPT_HALTED = 1
+PI_SCRIPT_RUNNING = 2
+
+LATENCY = float(os.environ.get('FAKE_PIGPIO_LATENCY', 0.0005))  # 1コマンドの往復時間（秒）
+COMMAND = struct.Struct('<IIII')  # pigpiodのコマンド形式（コマンド, p1, p2, p3）
+
+_daemon_address = None
+_daemon_lock = threading.Lock()
+
+def _serve(connection):
+    """模擬デーモンの接続1本分: 要求を受け取るたびにLATENCY秒待って同じ長さの応答を返す"""
+    with connection:
+        while True:
+            request = b''
+            while len(request) < COMMAND.size:
+                chunk = connection.recv(COMMAND.size - len(request))
+                if not chunk:
+                    return
+                request += chunk
+            if LATENCY:
+                time.sleep(LATENCY)
+            connection.sendall(request)
+
+def _accept(listener):
+    while True:
+        connection, _ = listener.accept()
+        threading.Thread(target=_serve, args=(connection,), daemon=True).start()
+
+def _daemon():
+    """ループバック上の模擬pigpiodのアドレス（最初の接続で起動する）"""
+    global _daemon_address
+    with _daemon_lock:
+        if _daemon_address is None:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(('127.0.0.1', 0))
+            listener.listen()
+            threading.Thread(target=_accept, args=(listener,), daemon=True, name='fake-pigpiod').start()
+            _daemon_address = listener.getsockname()
+        return _daemon_address
+
+class pi:
+    """pigpio.pi の代替（アプリが使うコマンドだけを持つ）"""
+    def __init__(self, host='localhost', port=8888):
+        self.commands = 0
+        self.levels = {}
+        self.dutycycles = {}
+        self.pulsewidths = {}
+        self._scripts = {}
+        self._lock = threading.Lock()
+        try:
+            self._socket = socket.create_connection(_daemon())
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connected = True
+        except OSError:
+            self._socket = None
+            self.connected = False
+
+    def _command(self, result=0):
+        with self._lock:
+            if self._socket is None:
+                raise ConnectionError('pigpio connection closed')
+            self._socket.sendall(COMMAND.pack(0, 0, 0, 0))
+            response = b''
+            while len(response) < COMMAND.size:
+                chunk = self._socket.recv(COMMAND.size - len(response))
+                if not chunk:
+                    raise ConnectionError('pigpio connection closed')
+                response += chunk
+            self.commands += 1
+        return result
+
+    def set_mode(self, gpio, mode):
+        return self._command()
+
+    def write(self, gpio, level):
+        self.levels[gpio] = level
+        return self._command()
+
+    def clear_bank_1(self, bits):
+        for gpio in range(32):
+            if bits & (1 << gpio):
+                self.levels[gpio] = 0
+        return self._command()
+
+    def set_bank_1(self, bits):
+        for gpio in range(32):
+            if bits & (1 << gpio):
+                self.levels[gpio] = 1
+        return self._command()
+
+    def set_PWM_dutycycle(self, gpio, dutycycle):
+        self.dutycycles[gpio] = dutycycle
+        return self._command()
+
+    def set_servo_pulsewidth(self, gpio, pulsewidth):
+        self.pulsewidths[gpio] = pulsewidth
+        return self._command()
+
+    def store_script(self, script):
+        script_id = len(self._scripts)
+        self._scripts[script_id] = script
+        return self._command(script_id)
+
+    def script_status(self, script_id):
+        return self._command((PI_SCRIPT_HALTED, [0] * 10))
+
+    def run_script(self, script_id, params=None):
+        # 本物はスクリプト全体が1回の往復で実行される
+        return self._command()
+
+    def delete_script(self, script_id):
+        self._scripts.pop(script_id, None)
+        return self._command()
+
+    def get_current_tick(self):
+        # 本物と同じく、接続が切れていれば例外になる
+        if not self.connected:
+            raise ConnectionError('pigpio connection closed')
+        self._command()
+        return int(time.monotonic() * 1e6) & 0xFFFFFFFF
+
+    def stop(self):
+        self.connected = False
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
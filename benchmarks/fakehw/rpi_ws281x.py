@@ -0,0 +1,36 @@
+"""
+ベンチマーク用のrpi_ws281xの代替（メモリ上のPixelStrip）
+show()はFAKE_LED_SHOW_TIME秒（既定はWS2812の転送時間: 1LEDあたり30us + リセット50us）待つ
+"""
+import os
+import time
+
+def Color(red, green, blue, white=0):
+    return (white << 24) | (red << 16) | (green << 8) | blue
+
+class PixelStrip:
+    def __init__(self, num, pin, freq_hz=800000, dma=10, invert=False, brightness=255, channel=0):
+        self._pixels = [0] * num
+        self.brightness = brightness
+        self.shows = 0
+        self.show_time = float(os.environ.get('FAKE_LED_SHOW_TIME', num * 30e-6 + 50e-6))
+
+    def begin(self):
+        pass
+
+    def numPixels(self):
+        return len(self._pixels)
+
+    def setPixelColor(self, n, color):
+        self._pixels[n] = color
+
+    def getPixelColor(self, n):
+        return self._pixels[n]
+
+    def setBrightness(self, brightness):
+        self.brightness = brightness
+
+    def show(self):
+        if self.show_time:
+            time.sleep(self.show_time)
+        self.shows += 1
@@ -0,0 +1,265 @@
+"""
+記録した制御コマンドのトレース（command_trace.py の形式）をサーバーに再送する負荷試験
+複数の模擬クライアントがそれぞれトレース全体を記録時の間隔のまま（--speed で早回し、0で待ち時間なし）送り、
+以下を計測して結果をJSONで出力する
+  ハンドラー遅延: コマンド送信からSocket.IOのack受信まで
+  送信遅れ:       模擬クライアントが予定時刻からどれだけ遅れて送れたか（大きい場合は試験側が追いついていない）
+  アクチュエータ: 反映数、遅れて反映した数（--late-ms 超）、反映前に新しいコマンドで置き換えられた数、反映不要だった数
+                  （サーバーの /metrics の差分から求めるため METRICS=0 では出力しない）
+走行コマンドはハートビートが DEADMAN_TIMEOUT 途絶えると停止されるため、
+模擬クライアントは記録の内容に関係なく --heartbeat 秒ごとにハートビートを送る
+
+使い方:
+  python -m benchmarks.replay_trace traces/trace-20240101-120000.jsonl --clients 10 --speed 4
+  python -m benchmarks.replay_trace trace.jsonl --url http://raspberrypi.local:5000 --speed 0
+--url を省略すると benchmarks/fakehw の代替モジュールでapp.pyをこのプロセス内に起動して再送する
+（--url で実機に送る場合は python-socketio のクライアント依存（websocket-client）が必要）
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from command_trace import load_trace
+from benchmarks.suite import percentile, git_revision, start_app
+
+ACTUATORS = ('motors', 'pitch', 'yaw', 'leds')
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def parse_metrics(text):
+    """Prometheusテキスト形式を {(名前, ((ラベル, 値), ...)): 値} にする"""
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[(name, tuple(sorted(LABEL.findall(labels or ''))))] = float(value)
+    return samples
+
+def actuation_summary(before, after, late_seconds):
+    """2回のスクレイプの差分からアクチュエータごとの反映数・遅延を求める"""
+    def delta(name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        return after.get(key, 0.0) - before.get(key, 0.0)
+
+    # 遅れの判定はヒストグラムのバケット境界で行う（late_seconds以下で最大の境界）
+    buckets = {}  # (アクチュエータ, 境界) -> ラベルのタプル
+    for name, labels in after:
+        labels_dict = dict(labels)
+        if name == 'rpicontest_command_actuation_seconds_bucket' and labels_dict['le'] != '+Inf':
+            buckets[(labels_dict['actuator'], float(labels_dict['le']))] = labels
+    bound = max((le for _, le in buckets if le <= late_seconds), default=None)
+    summary = {'late_threshold_ms': bound * 1000 if bound is not None else None}
+    for actuator in ACTUATORS:
+        count = delta('rpicontest_command_actuation_seconds_count', actuator=actuator)
+        total = delta('rpicontest_command_actuation_seconds_sum', actuator=actuator)
+        on_time = 0.0
+        labels = buckets.get((actuator, bound))
+        if labels is not None:
+            key = ('rpicontest_command_actuation_seconds_bucket', labels)
+            on_time = after[key] - before.get(key, 0.0)
+        summary[actuator] = {
+            'actuations': int(count),
+            'actuation_ms_mean': round(total / count * 1000, 3) if count else None,
+            'late': int(count - on_time) if bound is not None else None,
+            'coalesced': int(delta('rpicontest_commands_coalesced_total', actuator=actuator)),
+            'discarded': int(delta('rpicontest_commands_discarded_total', actuator=actuator))
+        }
+    return summary
+
+class LocalClient:
+    """プロセス内のサーバーに送るクライアント（Flask-SocketIOのテストクライアント、ack受信まで同期）"""
+    def __init__(self, app):
+        self._client = app.socketio.test_client(app.app)
+
+    def send(self, event, data, on_ack):
+        started = time.perf_counter()
+        if data is None:
+            self._client.emit(event, callback=True)
+        else:
+            self._client.emit(event, data, callback=True)
+        on_ack(time.perf_counter() - started)
+
+    def errors(self):
+        return sum(1 for message in self._client.get_received() if message['name'] == 'error')
+
+    def close(self):
+        self._client.disconnect()
+
+class RemoteClient:
+    """Socket.IOで実際のサーバーに送るクライアント（ackを待たずに次を送る）"""
+    def __init__(self, url):
+        import socketio
+        self._client = socketio.Client()
+        self._errors = 0
+        self._client.on('error', self._on_error)
+        self._client.connect(url, transports=['websocket'])
+
+    def _on_error(self, data=None):
+        self._errors += 1
+
+    def send(self, event, data, on_ack):
+        started = time.perf_counter()
+        self._client.emit(event, data, callback=lambda *args: on_ack(time.perf_counter() - started))
+
+    def errors(self):
+        return self._errors
+
+    def close(self):
+        self._client.disconnect()
+
+class Replayer(threading.Thread):
+    """模擬クライアント1つ分: トレースを予定時刻どおりに送る"""
+    def __init__(self, client, records, speed, heartbeat, start_at):
+        super().__init__(daemon=True)
+        self.client = client
+        self.records = records
+        self.speed = speed
+        self.heartbeat = heartbeat
+        self.start_at = start_at
+        self.latencies = []
+        self.send_delays = []
+        self.sent = 0
+        self.heartbeats = 0
+        self.error = None
+        self._next_heartbeat = start_at
+
+    def _beat(self, now):
+        if self.heartbeat > 0 and now >= self._next_heartbeat:
+            self.client.send('heartbeat', None, lambda latency: None)
+            self.heartbeats += 1
+            self._next_heartbeat = now + self.heartbeat
+
+    def _wait_until(self, due):
+        """予定時刻まで待つ（待っている間もハートビートを送る）"""
+        while True:
+            now = time.monotonic()
+            self._beat(now)
+            if now >= due:
+                return now
+            wake = due if self.heartbeat <= 0 else min(due, self._next_heartbeat)
+            time.sleep(max(0.0, wake - now))
+
+    def run(self):
+        try:
+            for offset, _, event, data in self.records:
+                # 速度0では開始時刻以降は待たずに送る（予定時刻がないので送信遅れは数えない）
+                due = self.start_at + (offset / self.speed if self.speed > 0 else 0.0)
+                now = self._wait_until(due)
+                if self.speed > 0:
+                    self.send_delays.append(now - due)
+                self.client.send(event, data, self.latencies.append)
+                self.sent += 1
+        except Exception as e:
+            self.error = str(e)
+
+def main():
+    parser = argparse.ArgumentParser(description='制御コマンドのトレースを再送する負荷試験')
+    parser.add_argument('trace', help='command_trace.py で記録したトレースファイル')
+    parser.add_argument('--url', help='送信先のサーバー（省略時はプロセス内に代替モジュールで起動）')
+    parser.add_argument('--clients', type=int, default=1, help='模擬クライアント数（それぞれがトレース全体を送る）')
+    parser.add_argument('--speed', type=float, default=1.0, help='再生速度（1で記録どおり、0で待ち時間なし）')
+    parser.add_argument('--stagger', type=float, default=0.0, help='模擬クライアントごとに開始をずらす秒数')
+    parser.add_argument('--heartbeat', type=float, default=0.25, help='ハートビートの送信間隔（秒、0で送らない）')
+    parser.add_argument('--late-ms', type=float, default=20.0, help='受信から反映までがこれを超えたら遅れとみなす（ミリ秒）')
+    parser.add_argument('--event', action='append', help='再送するイベント（複数指定可、省略時は全て）')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--pigpio-latency', type=float, default=None, help='プロセス内で起動する場合のpigpioの往復時間（秒）')
+    parser.add_argument('--output', help='結果を書き出すファイル（省略時は標準出力）')
+    args = parser.parse_args()
+
+    header, records = load_trace(args.trace)
+    if args.event:
+        records = [record for record in records if record[2] in args.event]
+    if not records:
+        print('再送するコマンドがありません', file=sys.stderr)
+        return 1
+
+    if args.url:
+        url = args.url.rstrip('/')
+        scrape = lambda: parse_metrics(urllib.request.urlopen(url + '/metrics', timeout=5).read().decode())
+        make_client = lambda: RemoteClient(url)
+        server = None
+    else:
+        app, server = start_app(args.port, args.pigpio_latency)
+        if app is None:
+            print('初期化に失敗しました', file=sys.stderr)
+            return 1
+        scrape = lambda: parse_metrics(app.metrics.render())
+        make_client = lambda: LocalClient(app)
+
+    try:
+        try:
+            before = scrape()
+        except Exception as e:
+            print(f'メトリクスを取得できません（アクチュエータの集計は省略）: {e}', file=sys.stderr)
+            before = None
+
+        clients = [make_client() for _ in range(args.clients)]
+        start_at = time.monotonic() + 0.5
+        replayers = [Replayer(client, records, args.speed, args.heartbeat, start_at + i * args.stagger)
+                     for i, client in enumerate(clients)]
+        for replayer in replayers:
+            replayer.start()
+        for replayer in replayers:
+            replayer.join()
+        elapsed = time.monotonic() - start_at
+        # 残りのackと更新ループの反映を待ってから集計する
+        time.sleep(0.5)
+
+        latencies = [latency for replayer in replayers for latency in replayer.latencies]
+        send_delays = [delay for replayer in replayers for delay in replayer.send_delays]
+        sent = sum(replayer.sent for replayer in replayers)
+        results = {
+            'benchmark': 'replay_trace',
+            'timestamp': time.time(),
+            'revision': git_revision(),
+            'trace': {
+                'path': args.trace,
+                'started': header.get('started'),
+                'commands': len(records),
+                'recorded_clients': len({record[1] for record in records}),
+                'duration': round(records[-1][0] - records[0][0], 3)
+            },
+            'target': args.url or 'in-process',
+            'clients': args.clients,
+            'speed': args.speed,
+            'elapsed': round(elapsed, 3),
+            'sent': sent,
+            'commands_per_sec': round(sent / elapsed, 1) if elapsed > 0 else None,
+            'acked': len(latencies),
+            'heartbeats': sum(replayer.heartbeats for replayer in replayers),
+            'handler_ms_mean': round(statistics.mean(latencies) * 1000, 3) if latencies else None,
+            'handler_ms_p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'handler_ms_max': round(max(latencies, default=0.0) * 1000, 3),
+            'send_delay_ms_p95': round(percentile(send_delays, 0.95) * 1000, 3) if send_delays else None,
+            'server_errors': sum(client.errors() for client in clients),
+            'client_errors': [replayer.error for replayer in replayers if replayer.error]
+        }
+        if before is not None:
+            results['actuators'] = actuation_summary(before, scrape(), args.late_ms / 1000)
+        for client in clients:
+            client.close()
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
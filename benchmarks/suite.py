@@ -0,0 +1,295 @@
+"""
+ハードウェアなしで映像・制御経路を計測するベンチマーク
+benchmarks/fakehw の代替モジュールでpigpio・rpi_ws281x・picamera2を置き換えてapp.pyを読み込み、
+以下を計測して結果をJSONで出力する
+  video:   /video_feed クライアント数ごとの受信fps、キャプチャから送信完了までの遅延
+  control: Socket.IOコマンドの処理スループットと、受信からpigpio・show()呼び出しまでの時間
+  led:     LEDフレームの生成・描画にかかる時間
+
+使い方:
+  python -m benchmarks.suite [--clients 1,5,10,25,50] [--duration 5] [--output results.json]
+  python -m benchmarks.suite --only control --pigpio-latency 0.002
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKEHW = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakehw')
+
+BOUNDARY = b'--frame\r\n'
+
+def percentile(values, fraction):
+    """values の fraction 分位点（空なら0）"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class StreamReader(threading.Thread):
+    """/video_feed を読み続け、受信したフレーム数を数えるクライアント"""
+    def __init__(self, port, profile):
+        super().__init__(daemon=True)
+        self.port = port
+        self.profile = profile
+        self.frames = 0
+        self.bytes = 0
+        self.running = True
+        self.error = None
+
+    def run(self):
+        try:
+            sock = socket.create_connection(('127.0.0.1', self.port))
+            sock.sendall(f'GET /video_feed?profile={self.profile} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+            tail = b''
+            while self.running:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                self.bytes += len(data)
+                # チャンクの境界をまたぐ区切りも数えられるよう、前回の末尾をつなげて探す
+                chunk = tail + data
+                self.frames += chunk.count(BOUNDARY)
+                tail = chunk[-(len(BOUNDARY) - 1):]
+            sock.close()
+        except OSError as e:
+            self.error = str(e)
+
+def process_usage():
+    """このプロセスのスレッド数と常駐メモリ（KB）"""
+    usage = {'threads': threading.active_count(), 'rss_kb': None}
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    usage['rss_kb'] = int(line.split()[1])
+                elif line.startswith('Threads:'):
+                    usage['threads'] = int(line.split()[1])
+    except OSError:
+        pass
+    return usage
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+def bench_video(app, port, client_counts, duration, profile, warmup=1.0):
+    """クライアント数ごとの受信fpsと遅延"""
+    rendition = app.stream_renditions[profile]
+    results = []
+    for count in client_counts:
+        readers = [StreamReader(port, profile) for _ in range(count)]
+        for reader in readers:
+            reader.start()
+        wait_until(lambda: len(app.stream_clients) >= count, timeout=5.0)
+        time.sleep(warmup)
+
+        frames_before = [reader.frames for reader in readers]
+        captured_before = app.camera.frames
+        published_before = rendition.broker.latest()[0]
+        lags = []
+        started = time.monotonic()
+        # 遅延はサーバー側で計測している値（キャプチャからソケットへの書き込み完了まで）を定期的に集める
+        while time.monotonic() - started < duration:
+            lags.extend(client.lag for client in list(app.stream_clients.values()) if client.frames_sent)
+            time.sleep(0.1)
+        elapsed = time.monotonic() - started
+
+        fps = [(reader.frames - before) / elapsed for reader, before in zip(readers, frames_before)]
+        dropped = sum(client.frames_dropped for client in list(app.stream_clients.values()))
+        usage = process_usage()
+        for reader in readers:
+            reader.running = False
+        for reader in readers:
+            reader.join(timeout=2.0)
+        wait_until(lambda: not app.stream_clients, timeout=5.0)
+
+        results.append({
+            'clients': count,
+            'capture_fps': round((app.camera.frames - captured_before) / elapsed, 2),
+            'published_fps': round((rendition.broker.latest()[0] - published_before) / elapsed, 2),
+            'client_fps_mean': round(statistics.mean(fps), 2),
+            'client_fps_min': round(min(fps), 2),
+            'lag_ms_mean': round(statistics.mean(lags) * 1000, 2) if lags else None,
+            'lag_ms_p95': round(percentile(lags, 0.95) * 1000, 2),
+            'frames_dropped': dropped,
+            'errors': sum(1 for reader in readers if reader.error),
+            'server_threads': usage['threads'] - count,  # 計測用クライアントのスレッドを除く
+            'rss_kb': usage['rss_kb']
+        })
+        print(f"video: {count} clients -> {results[-1]['client_fps_mean']} fps, "
+              f"lag {results[-1]['lag_ms_mean']} ms", file=sys.stderr)
+    return results
+
+def bench_control(app, events):
+    """Socket.IOコマンドの処理スループットとアクチュエータへの反映時間"""
+    client = app.socketio.test_client(app.app)
+    commands = {
+        'motor_control': lambda i: {'action': ('forward', 'left', 'right', 'backward')[i % 4], 'speed': 50 + i % 50},
+        'servo_angle': lambda i: {'type': ('pitch', 'yaw')[i % 2], 'angle': i % 181},
+        'led_control': lambda i: {'action': 'set_color', 'led_index': i % app.LED_COUNT,
+                                  'r': i % 256, 'g': (i * 7) % 256, 'b': (i * 13) % 256},
+    }
+    actuators = {'motor_control': ['motors'], 'servo_angle': ['pitch', 'yaw'], 'led_control': ['leds']}
+    results = {}
+    for event, make_payload in commands.items():
+        before = {name: app.command_actuation_seconds.totals(actuator=name) for name in actuators[event]}
+        started = time.perf_counter()
+        for i in range(events):
+            client.emit(event, make_payload(i))
+            if event == 'motor_control' and i % 100 == 0:
+                client.emit('heartbeat')
+        elapsed = time.perf_counter() - started
+        # 更新ループ・レンダースレッドが最後のコマンドを反映するまで待つ
+        time.sleep(0.2)
+
+        actuated = 0
+        total = 0.0
+        for name in actuators[event]:
+            count, seconds = app.command_actuation_seconds.totals(actuator=name)
+            actuated += count - before[name][0]
+            total += seconds - before[name][1]
+        results[event] = {
+            'events': events,
+            'events_per_sec': round(events / elapsed, 1),
+            'handler_us_mean': round(elapsed / events * 1e6, 2),
+            'actuations': actuated,
+            'actuation_ms_mean': round(total / actuated * 1000, 3) if actuated else None
+        }
+        print(f"control: {event} -> {results[event]['events_per_sec']} events/s", file=sys.stderr)
+
+    client.emit('motor_control', {'action': 'stop'})
+    results['pigpio_commands'] = app.pi.commands
+    client.disconnect()
+    return results
+
+def bench_led(app, frames):
+    """LEDフレームの生成とストリップへの描画にかかる時間"""
+    engine = app.led_engine
+    rainbow = app.RainbowAnimation()
+    chase = app.ChaseAnimation(255, 0, 0)
+
+    def per_frame(function):
+        started = time.perf_counter()
+        for i in range(frames):
+            function(i)
+        return round((time.perf_counter() - started) / frames * 1e6, 2)
+
+    patterns = [[(random.randrange(256), random.randrange(256), random.randrange(256))
+                 for _ in range(app.LED_COUNT)] for _ in range(16)]
+    shows_before = app.strip.shows
+    results = {
+        'rainbow_render_us': per_frame(lambda i: rainbow.render(i / app.LED_FRAME_RATE)),
+        'chase_render_us': per_frame(lambda i: chase.render(i / app.LED_FRAME_RATE)),
+        # 毎回異なる色: 明度テーブルの適用 + setPixelColor + show()
+        'show_changed_us': per_frame(lambda i: engine._show(patterns[i % len(patterns)])),
+        # 同じ色: 変化なしでshow()を省略する経路
+        'show_unchanged_us': per_frame(lambda i: engine._show(patterns[0])),
+        'strip_show_time_us': round(app.strip.show_time * 1e6, 2),
+    }
+    results['strip_shows'] = app.strip.shows - shows_before
+    print(f"led: show {results['show_changed_us']} us/frame", file=sys.stderr)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def start_app(port, pigpio_latency=None, camera_fps=None):
+    """
+    代替モジュールでapp.pyを読み込み、ワーカーとローカルのHTTPサーバーを開始する
+    return: (appモジュール, werkzeugサーバー)、初期化に失敗した場合は (None, None)
+    """
+    # 代替モジュールの設定は読み込み前に環境変数で渡す
+    if pigpio_latency is not None:
+        os.environ['FAKE_PIGPIO_LATENCY'] = str(pigpio_latency)
+    if camera_fps is not None:
+        os.environ['FAKE_CAMERA_FPS'] = str(camera_fps)
+    os.environ.setdefault('TIMESHIFT_SECONDS', '0')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path[:0] = [FAKEHW, ROOT]
+
+    import app
+    from werkzeug.serving import make_server
+
+    if not (app.init_pigpio() and app.init_neopixel() and app.init_camera()):
+        return None, None
+    app.start_workers()
+    server = make_server('127.0.0.1', port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return app, server
+
+def main():
+    parser = argparse.ArgumentParser(description='ハードウェアなしのベンチマーク')
+    parser.add_argument('--only', choices=['video', 'control', 'led'], action='append',
+                        help='実行する計測（複数指定可、省略時は全て）')
+    parser.add_argument('--clients', default='1,5,10,25,50', help='/video_feed クライアント数（カンマ区切り）')
+    parser.add_argument('--duration', type=float, default=5.0, help='クライアント数ごとの計測時間（秒）')
+    parser.add_argument('--profile', default='full', help='計測するレンディション')
+    parser.add_argument('--events', type=int, default=2000, help='イベント種類ごとのコマンド数')
+    parser.add_argument('--led-frames', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--pigpio-latency', type=float, default=None, help='pigpioの1コマンドの往復時間（秒）')
+    parser.add_argument('--camera-fps', type=float, default=None)
+    parser.add_argument('--output', help='結果を書き出すファイル（省略時は標準出力）')
+    args = parser.parse_args()
+    benches = args.only or ['video', 'control', 'led']
+
+    app, server = start_app(args.port, args.pigpio_latency, args.camera_fps)
+    if app is None:
+        print('初期化に失敗しました', file=sys.stderr)
+        return 1
+    import pigpio
+    import picamera2
+
+    results = {
+        'benchmark': 'suite',
+        'timestamp': time.time(),
+        'revision': git_revision(),
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'async_mode': app.ASYNC_MODE,
+            'encode_workers': app.ENCODE_WORKERS,
+            'pigpio_latency': pigpio.LATENCY,
+            'camera_fps': picamera2.FPS,
+            'metrics_enabled': app.metrics.enabled
+        }
+    }
+    try:
+        if 'video' in benches:
+            client_counts = [int(count) for count in args.clients.split(',') if count]
+            results['video'] = bench_video(app, args.port, client_counts, args.duration, args.profile)
+        if 'control' in benches:
+            results['control'] = bench_control(app, args.events)
+        if 'led' in benches:
+            results['led'] = bench_led(app, args.led_frames)
+    finally:
+        server.shutdown()
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
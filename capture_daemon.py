@@ -0,0 +1,105 @@
+"""
+カメラのキャプチャとJPEGエンコードを行う独立プロセス
+エンコード済みフレームを共有メモリのリングバッファ（frame_ring.py）に書き込み、
+CAPTURE_SOURCE=shm で起動した1つ以上のapp.pyがそれを読んで配信する
+ハードウェアを制御するのは1つの制御サーバーだけで、2つ目以降は VIDEO_ONLY=1 で映像配信専用にする
+（pigpio・NeoPixelの初期化と制御用のワーカーを行わない）
+Webサーバーを再起動してもカメラは止まらない
+キャプチャ・エンコードは capture_pipeline.py を使い、app.py（Flask・pigpioなど）は読み込まない
+
+使い方:
+  python capture_daemon.py [レンディション名 ...]   （省略時は全レンディション）
+  CAPTURE_SOURCE=shm SERVER_PORT=5000 python app.py                （制御サーバー）
+  CAPTURE_SOURCE=shm VIDEO_ONLY=1 SERVER_PORT=5001 python app.py   （映像配信専用）
+"""
+import signal
+import sys
+import time
+
+from capture_pipeline import (
+    CAMERA_RESOLUTION, ENCODE_WORKERS, CAMERA_IDLE_STOP, CHANGE_DETECTION, STREAM_PROFILES,
+    FrameEncoder, ChangeDetector, open_camera, capture_frame
+)
+from frame_buffers import FramePool
+from frame_ring import FrameRing, ring_name
+
+READER_TIMEOUT = 2.0   # この秒数読み出しがないレンディションはエンコードを止める
+IDLE_INTERVAL = 0.02   # 視聴者がいない間に読み出し側を確認する間隔（秒）
+
+def run(profiles):
+    """キャプチャループ"""
+    rings = {}
+    encoders = {}
+    for name in profiles:
+        profile = STREAM_PROFILES[name]
+        rings[name] = FrameRing.create(ring_name(name))
+        # エンコード結果はキャプチャ順にリングへ書き込まれる（JPEG本体のviewをコピーせずに渡す）
+        encoders[name] = FrameEncoder(
+            lambda frame, captured_at, ring=rings[name]: ring.write(frame.view, captured_at),
+            quality=profile['quality'], scale=profile['scale'], name=name)
+    pool = FramePool((CAMERA_RESOLUTION[1], CAMERA_RESOLUTION[0], 3),
+                     limit=ENCODE_WORKERS * len(profiles) + 1)
+    detector = ChangeDetector() if CHANGE_DETECTION else None
+    print(f"フレームリングを作成しました: {', '.join(profiles)}")
+
+    camera = None
+    camera_running = False
+    try:
+        try:
+            camera = open_camera()
+            camera_running = True
+        except Exception as e:
+            print(f"カメラの初期化に失敗しました: {e}")
+            return 1
+
+        streaming = False
+        while True:
+            now = time.monotonic()
+            for ring in rings.values():
+                ring.touch_producer()
+
+            # 最近読み出されたレンディションだけをエンコードする
+            watched = [name for name, ring in rings.items() if now - ring.reader_heartbeat < READER_TIMEOUT]
+            if not watched:
+                if streaming:
+                    streaming = False
+                    print("視聴者がいないためキャプチャを休止します")
+                if CAMERA_IDLE_STOP and camera_running:
+                    camera.stop()
+                    camera_running = False
+                time.sleep(IDLE_INTERVAL)
+                continue
+
+            if not camera_running:
+                camera.start()
+                camera_running = True
+            if not streaming:
+                streaming = True
+                print("キャプチャを再開します")
+
+            capture_frame(camera, pool, [encoders[name] for name in watched], detector)
+
+    except KeyboardInterrupt:
+        print("キャプチャデーモンが中断されました")
+    finally:
+        for encoder in encoders.values():
+            encoder.shutdown()
+        for ring in rings.values():
+            ring.close()
+        if camera is not None:
+            if camera_running:
+                camera.stop()
+            camera.close()
+        print("キャプチャデーモン終了処理完了")
+    return 0
+
+if __name__ == '__main__':
+    # systemctl stop などのSIGTERMでも終了処理（共有メモリの削除）を行う
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    profiles = sys.argv[1:] or list(STREAM_PROFILES)
+    unknown = [name for name in profiles if name not in STREAM_PROFILES]
+    if unknown:
+        print(f"未知のプロファイル: {', '.join(unknown)}")
+        sys.exit(1)
+    sys.exit(run(profiles))
@@ -0,0 +1,281 @@
+"""
+カメラのキャプチャとJPEGエンコードの段
+app.py（CAPTURE_SOURCE=local）と capture_daemon.py の両方から使うため、
+Flask・Socket.IO・pigpioなどapp.pyの他の部分には依存しない
+計測やgeventでのOSスレッド実行は呼び出し側から関数で渡す
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from libcamera import Transform
+from picamera2 import Picamera2, MappedArray
+
+from frame_buffers import EncodedFrame
+
+CAMERA_RESOLUTION = (640, 480)  # キャプチャ解像度 (幅, 高さ)
+JPEG_QUALITY = 70               # JPEG品質 (0-100)
+ENCODE_WORKERS = os.cpu_count() or 1  # JPEGエンコードのワーカースレッド数
+# 視聴者がいない間はPicamera2のパイプラインも停止する（CAMERA_IDLE_STOP=1 で有効）
+# 停止中の消費電力は減るが、再開時にカメラの起動と自動露出の収束を待つため最初のフレームが遅れる
+# 既定ではカメラは動かしたまま、キャプチャ・エンコード・配信だけを休止する（1フレーム以内に再開できる）
+CAMERA_IDLE_STOP = os.environ.get('CAMERA_IDLE_STOP', '0') == '1'
+# 変化検出: 前回エンコードしたフレームからほとんど変化がなければエンコードを省く
+CHANGE_DETECTION = True
+CHANGE_DOWNSAMPLE = 8             # 判定に使う縮小率（縦横この間隔で間引く）
+CHANGE_PIXEL_THRESHOLD = 24       # 変化ありとみなす画素のRGB合計の差
+CHANGE_AREA_THRESHOLD = 0.005     # 変化した画素の割合がこれを超えたらエンコードする
+CHANGE_KEYFRAME_INTERVAL = 1.0    # 変化がなくてもこの秒数ごとにエンコードする
+
+# 配信レンディション（/video_feed?profile=名前 で選択）
+# scale: キャプチャ解像度に対する縮小率, quality: JPEG品質
+STREAM_PROFILES = {
+    'full': {'scale': 1.0, 'quality': JPEG_QUALITY},
+    'half': {'scale': 0.5, 'quality': JPEG_QUALITY},
+    'low':  {'scale': 0.5, 'quality': 40},
+}
+
+def open_camera(resolution=CAMERA_RESOLUTION):
+    """
+    カメラを設定して開始する（上下左右反転）
+    失敗した場合はカメラを閉じてから例外を送出する
+    """
+    camera = Picamera2()
+    try:
+        config = camera.create_video_configuration(
+            main={"size": resolution, "format": "RGB888"},
+            transform=Transform(hflip=True, vflip=True)
+        )
+        camera.configure(config)
+        camera.start()
+    except Exception:
+        try:
+            camera.close()
+        except Exception:
+            pass
+        raise
+    return camera
+
+class FrameEncoder:
+    """
+    JPEGエンコードを複数のワーカースレッドに分散するエンコードステージ
+    cv2.imencodeはGILを解放するため、スレッドで全コアを使える
+    完了した結果はキャプチャ順に並べ直して発行し、
+    全ワーカーが使用中の間に届いたフレームは待たせずに破棄する
+    scaleが1未満の場合はエンコード前にワーカー内で縮小する
+    run(function, *args): 縮小・エンコードの実行方法（geventではOSスレッドで実行する関数を渡す）
+    on_encoded(encoder, encode_seconds, result): 1枚エンコードするたびにワーカースレッドから呼ばれる（計測用）
+    """
+    def __init__(self, publish, workers=ENCODE_WORKERS, quality=JPEG_QUALITY, scale=1.0, name='',
+                 run=None, on_encoded=None):
+        self.name = name
+        self._publish = publish
+        self._run = run or (lambda function, *args: function(*args))
+        self._on_encoded = on_encoded
+        self._params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self._scale = scale
+        self._max_in_flight = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_in_flight,
+                                            thread_name_prefix='jpeg-encoder')
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # シーケンス番号 -> (エンコード結果, キャプチャ時刻)（未完了はNone）
+        self._next_sequence = 0
+        self.dropped = 0
+        self.encoded = 0
+        self.cpu_time = 0.0  # 縮小・エンコードにかかったCPU時間の合計（秒）
+
+    def submit(self, frame, captured_at=None, on_done=None):
+        """
+        フレームをエンコードに回す
+        captured_at: キャプチャ時刻（time.time()）
+        on_done: frameを読み終えた時点で呼ぶ関数（プールの配列を返却するため、受け付けた場合のみ）
+        return: 受け付けた場合True、ワーカーが埋まっていて破棄した場合False
+        """
+        with self._lock:
+            if len(self._pending) >= self._max_in_flight:
+                self.dropped += 1
+                return False
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            self._pending[sequence] = None
+        self._executor.submit(self._encode, sequence, frame, captured_at, on_done)
+        return True
+
+    def _encode(self, sequence, frame, captured_at, on_done=None):
+        """ワーカースレッドでエンコードし、先頭から順に完了したものを発行する"""
+        try:
+            result, encode_seconds, elapsed = self._run(self._compress, frame)
+            if self._on_encoded is not None:
+                self._on_encoded(self, encode_seconds, result)
+        except Exception as e:
+            print(f"JPEGエンコードエラー: {e}")
+            result = False
+            elapsed = 0.0
+        finally:
+            if on_done is not None:
+                on_done()
+        
+        with self._lock:
+            self.encoded += 1
+            self.cpu_time += elapsed
+            self._pending[sequence] = (result, captured_at)
+            # 先行するフレームが全て完了している分だけキャプチャ順に発行
+            while self._pending:
+                head = next(iter(self._pending))
+                if self._pending[head] is None:
+                    break
+                encoded, encoded_captured_at = self._pending.pop(head)
+                if encoded is not False:
+                    self._publish(encoded, encoded_captured_at)
+
+    def _compress(self, frame):
+        """
+        縮小とJPEGエンコード（非同期モードではOSスレッドで実行される）
+        return: (エンコード結果, imencodeの所要時間, CPU時間)
+        """
+        started = time.thread_time()
+        if self._scale != 1.0:
+            frame = cv2.resize(frame, None, fx=self._scale, fy=self._scale,
+                               interpolation=cv2.INTER_AREA)
+        encode_started = time.perf_counter()
+        ok, buffer = cv2.imencode('.jpg', frame, self._params)
+        encode_seconds = time.perf_counter() - encode_started
+        # multipartチャンクをここで1回だけ組み立て、以降は全クライアントで共有する
+        result = EncodedFrame(buffer) if ok else False
+        return result, encode_seconds, time.thread_time() - started
+
+    @property
+    def average_cpu(self):
+        """1フレームあたりの平均エンコードCPU時間（秒）"""
+        return self.cpu_time / self.encoded if self.encoded else 0.0
+
+    def shutdown(self):
+        """ワーカースレッドを停止"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class ChangeDetector:
+    """
+    キャプチャしたフレームを縮小して最後にエンコードしたフレームと比べ、
+    変化がなければエンコードと配信を省くゲート
+    各画素のRGB合計の差がpixel_thresholdを超える画素の割合がarea_thresholdを超えたら変化ありとする
+    変化がなくてもkeyframe_intervalごと、およびエンコード対象のレンディションが変わったときはエンコードする
+    比較の基準はエンコーダーが実際にフレームを受け付けてからcommit()で更新する
+    """
+    def __init__(self, step=CHANGE_DOWNSAMPLE, pixel_threshold=CHANGE_PIXEL_THRESHOLD,
+                 area_threshold=CHANGE_AREA_THRESHOLD, keyframe_interval=CHANGE_KEYFRAME_INTERVAL):
+        self.step = step
+        self.pixel_threshold = pixel_threshold
+        self.area_threshold = area_threshold
+        self.keyframe_interval = keyframe_interval
+        self._reference = None
+        self._targets = ()
+        self._encoded_at = 0.0
+        self._candidate = None   # 変化ありと判定し、まだエンコーダーに受け付けられていない (縮小フレーム, 対象, 時刻)
+        self.frames_checked = 0
+        self.frames_skipped = 0
+        self.last_change = 0.0   # 直前の判定での変化画素の割合
+        self.cpu_saved = 0.0     # 省いたエンコードのCPU時間の推定（秒）
+        self.detector_cpu = 0.0  # 判定自体にかかったCPU時間（秒）
+
+    def should_encode(self, frame, encoders):
+        """
+        frameをエンコードすべきか判定する
+        encoders: このフレームを渡す予定のエンコーダー
+        """
+        started = time.thread_time()
+        now = time.monotonic()
+        # 縮小はスライスで間引くだけ（RGBの合計はint16に収まる）
+        small = frame[::self.step, ::self.step].sum(axis=2, dtype=np.int16)
+        targets = tuple(id(encoder) for encoder in encoders)
+        
+        if (self._reference is None or targets != self._targets
+                or now - self._encoded_at >= self.keyframe_interval):
+            changed = True
+        else:
+            changed_pixels = int(np.count_nonzero(np.abs(small - self._reference) > self.pixel_threshold))
+            self.last_change = changed_pixels / small.size
+            changed = self.last_change > self.area_threshold
+        
+        self.frames_checked += 1
+        if changed:
+            self._candidate = (small, targets, now)
+        else:
+            self._candidate = None
+            self.frames_skipped += 1
+            self.cpu_saved += sum(encoder.average_cpu for encoder in encoders)
+        self.detector_cpu += time.thread_time() - started
+        return changed
+
+    def commit(self):
+        """
+        直前にshould_encodeがTrueを返したフレームを比較の基準にする
+        全エンコーダーが受け付けた場合だけ呼ぶ（破棄されたフレームを基準にすると変化が配信されないままになる）
+        """
+        if self._candidate is not None:
+            self._reference, self._targets, self._encoded_at = self._candidate
+            self._candidate = None
+
+    def status(self):
+        """省いたフレーム数と節約したCPU時間"""
+        return {
+            'frames_checked': self.frames_checked,
+            'frames_skipped': self.frames_skipped,
+            'skip_ratio': round(self.frames_skipped / self.frames_checked, 3) if self.frames_checked else 0.0,
+            'last_change': round(self.last_change, 4),
+            'cpu_saved_s': round(self.cpu_saved, 3),
+            'detector_cpu_s': round(self.detector_cpu, 3),
+            'net_cpu_saved_s': round(self.cpu_saved - self.detector_cpu, 3)
+        }
+
+def capture_into(camera, array):
+    """カメラのリクエストのバッファからarrayに直接コピーする（ストライドの詰め物は除く）"""
+    with camera.captured_request() as capture_request:
+        with MappedArray(capture_request, 'main') as mapped:
+            height, width = array.shape[:2]
+            np.copyto(array, mapped.array[:height, :width, :3])
+
+def capture_frame(camera, pool, encoders, detector=None, vision=None, run=None):
+    """
+    cameraからフレームを1枚キャプチャしてエンコーダーに渡す
+    capture_arrayのように毎フレーム配列を確保せず、リクエストのバッファからプールの配列にコピーし、
+    全エンコーダーが読み終えた時点でプールに戻す
+    detector: ChangeDetector（変化がなければエンコーダーに渡さない）
+    vision: VisionStage（変化の有無によらず全フレームを渡し、縮小コピーを解析させる）
+    run(function, *args): Picamera2の呼び出し方法（geventではOSスレッドで実行する関数を渡す）
+    """
+    run = run or (lambda function, *args: function(*args))
+    pooled = pool.acquire()
+    if pooled is None:
+        # 全ての配列がエンコード待ち（プールの上限はエンコーダーの同時処理数から決めているため通常は起きない）
+        frame = run(camera.capture_array)
+        captured_at = time.time()
+        if vision is not None:
+            vision.submit(frame, captured_at)
+        if detector is None or detector.should_encode(frame, encoders):
+            accepted = [encoder.submit(frame, captured_at) for encoder in encoders]
+            if detector is not None and all(accepted):
+                detector.commit()
+        return
+    
+    try:
+        run(capture_into, camera, pooled.array)
+        captured_at = time.time()
+        if vision is not None:
+            vision.submit(pooled.array, captured_at)
+        if detector is not None and not detector.should_encode(pooled.array, encoders):
+            return
+        
+        accepted = True
+        for encoder in encoders:
+            pooled.retain()
+            if not encoder.submit(pooled.array, captured_at, on_done=pooled.release):
+                pooled.release()
+                accepted = False
+        if detector is not None and accepted:
+            detector.commit()
+    finally:
+        pooled.release()
@@ -0,0 +1,151 @@
+"""
+Socket.IO制御コマンドのトレース記録と読み込み
+運用中に受信したコマンドを受信時刻つきでJSON Linesに書き出し、
+benchmarks/replay_trace.py で同じ間隔のまま（または早回しで）サーバーに送り直せるようにする
+
+ファイル形式（1行1レコード）:
+  1行目: {"trace": バージョン, "started": 記録開始時刻（time.time()）}
+  以降:  {"t": 記録開始からの秒数, "client": クライアント番号, "event": イベント名, "data": ペイロード}
+クライアント番号はsidの代わりに記録開始後に現れた順に振る（sidはファイルに残さない）
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+TRACE_VERSION = 1
+
+class CommandTrace:
+    """
+    受信したコマンドをファイルに書き出す記録機
+    ハンドラーからは有界キューに入れるだけで、書き込みは専用スレッドが行う（溢れた分は破棄して数える）
+    """
+    def __init__(self, directory, queue_size=4096):
+        self.directory = directory
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._queue = None
+        self._stopping = None  # 記録中のセッションの停止要求（threading.Event）
+        self._thread = None
+        self._clients = {}   # sid -> クライアント番号
+        self._started = 0.0  # 記録開始時刻（time.monotonic()）
+        self.recording = False
+        self.path = None
+        self.records = 0
+        self.dropped = 0
+
+    def start(self):
+        """記録を開始（記録中はFalse）"""
+        with self._lock:
+            if self.recording:
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            self.path = os.path.join(self.directory, 'trace-' + time.strftime('%Y%m%d-%H%M%S') + '.jsonl')
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._clients = {}
+            self._started = time.monotonic()
+            self.records = 0
+            self.dropped = 0
+            self.recording = True
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._write_loop,
+                                            args=(self._queue, self._stopping, self.path, time.time()),
+                                            daemon=True, name='command-trace')
+            self._thread.start()
+        return True
+
+    def stop(self, timeout=None):
+        """
+        記録を停止（キューに残ったレコードは書き込んでからファイルを閉じる、ブロックしない）
+        timeout: 指定した場合は書き込みが終わるまで最大その秒数待つ（終了処理用）
+        """
+        with self._lock:
+            if not self.recording:
+                return False
+            self.recording = False
+            self._stopping.set()
+            try:
+                # 書き込みスレッドをすぐ起こす（キューが一杯なら停止要求を見て、空になった時点で終わる）
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+            thread = self._thread
+        if timeout is not None:
+            thread.join(timeout)
+        return True
+
+    def record(self, sid, event, data):
+        """受信したコマンドを1件記録する（ブロックしない）"""
+        if not self.recording:
+            return
+        offset = time.monotonic() - self._started
+        with self._lock:
+            client = self._clients.setdefault(sid, len(self._clients))
+        try:
+            self._queue.put_nowait((offset, client, event, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def status(self):
+        """記録の状態"""
+        return {
+            'recording': self.recording,
+            'path': self.path,
+            'clients': len(self._clients),
+            'records': self.records,
+            'dropped': self.dropped
+        }
+
+    def _write_loop(self, records, stopping, path, started):
+        """書き込みスレッド（溜まっている分はまとめて書く）"""
+        try:
+            with open(path, 'w') as f:
+                f.write(json.dumps({'trace': TRACE_VERSION, 'started': started}) + '\n')
+                running = True
+                while running:
+                    try:
+                        batch = [records.get(timeout=0.5)]
+                    except queue.Empty:
+                        running = not stopping.is_set()
+                        continue
+                    while True:
+                        try:
+                            batch.append(records.get_nowait())
+                        except queue.Empty:
+                            break
+                    lines = []
+                    for item in batch:
+                        if item is None:
+                            running = False
+                            continue
+                        offset, client, event, data = item
+                        lines.append(json.dumps({'t': round(offset, 6), 'client': client,
+                                                 'event': event, 'data': data},
+                                                ensure_ascii=False, default=str) + '\n')
+                    f.write(''.join(lines))
+                    f.flush()
+                    self.records += len(lines)
+        except OSError as e:
+            print(f"コマンドトレース書き込みエラー: {e}")
+            with self._lock:
+                if self._queue is records:
+                    self.recording = False
+
+def load_trace(path):
+    """
+    トレースファイルを読み込む
+    return: (ヘッダのdict, [(秒数, クライアント番号, イベント名, ペイロード), ...]（時刻順）)
+    """
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get('trace') != TRACE_VERSION:
+            raise ValueError(f'トレースの形式が異なります: {path}')
+        records = []
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                records.append((record['t'], record['client'], record['event'], record.get('data')))
+    records.sort(key=lambda record: record[0])
+    return header, records
@@ -0,0 +1,134 @@
+"""
+ブロックしない構造化ログ
+呼び出し側はレコードを有界キューに入れるだけで、標準出力への書き込みは専用スレッドが行う
+（journaldのパイプや遅い端末でもSocket.IOハンドラーを待たせない）
+イベントの種類ごとに間引き（N件に1件）と流量制限（1秒あたりの件数）を設定できる
+"""
+import json
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+class EventRule:
+    """
+    イベント1種類分の出力制限
+    sample: N件に1件だけ出力する（1で全件）
+    rate: 1秒あたりの最大件数（トークンバケット、Noneで無制限）
+    """
+    def __init__(self, sample=1, rate=None):
+        self.sample = max(1, sample)
+        self.rate = rate
+        self._seen = 0
+        self._burst = max(1.0, rate or 0.0)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self.suppressed = 0  # 前回出力してから間引いた件数
+
+    def allow(self):
+        """このレコードを出力するか"""
+        self._seen += 1
+        if self._seen % self.sample:
+            self.suppressed += 1
+            return False
+        if self.rate is not None:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1.0:
+                self.suppressed += 1
+                return False
+            self._tokens -= 1.0
+        return True
+
+class EventLogger:
+    """
+    キューと書き込みスレッドを持つロガー
+    style: 'text'（時刻 レベル イベント メッセージ key=value ...）または 'json'（1行1レコード）
+    """
+    def __init__(self, level=INFO, rules=None, queue_size=1024, stream=None, style='text'):
+        self.level = LEVELS.get(level.upper(), INFO) if isinstance(level, str) else level
+        self.style = style
+        self._stream = stream
+        self._rules = {event: EventRule(**rule) for event, rule in (rules or {}).items()}
+        self._rules_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0  # キューが一杯で捨てたレコード数
+        self._thread = threading.Thread(target=self._write_loop, daemon=True, name='event-log')
+        self._thread.start()
+
+    def log(self, level, event, message='', **fields):
+        """レコードをキューに入れる（ブロックしない）"""
+        if level < self.level:
+            return
+        suppressed = 0
+        rule = self._rules.get(event)
+        if rule is not None:
+            with self._rules_lock:
+                if not rule.allow():
+                    return
+                suppressed, rule.suppressed = rule.suppressed, 0
+        if suppressed:
+            fields['suppressed'] = suppressed
+        try:
+            self._queue.put_nowait((time.time(), level, event, message, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event, message='', **fields):
+        self.log(DEBUG, event, message, **fields)
+
+    def info(self, event, message='', **fields):
+        self.log(INFO, event, message, **fields)
+
+    def warning(self, event, message='', **fields):
+        self.log(WARNING, event, message, **fields)
+
+    def error(self, event, message='', **fields):
+        self.log(ERROR, event, message, **fields)
+
+    def flush(self, timeout=1.0):
+        """キューが空になるまで待つ（終了処理用）"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _format(self, timestamp, level, event, message, fields):
+        if self.style == 'json':
+            record = {'ts': round(timestamp, 6), 'level': LEVEL_NAMES.get(level, level),
+                      'event': event, 'msg': message}
+            record.update(fields)
+            return json.dumps(record, ensure_ascii=False, default=str)
+
+        text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+        parts = [f'{text}.{int(timestamp * 1000) % 1000:03d}', LEVEL_NAMES.get(level, str(level)), event]
+        if message:
+            parts.append(message)
+        parts.extend(f'{key}={value}' for key, value in fields.items())
+        return ' '.join(parts)
+
+    def _write_loop(self):
+        """書き込みスレッド（溜まっている分はまとめて書いてからflushする）"""
+        while True:
+            records = [self._queue.get()]
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                stream = self._stream or sys.stdout
+                stream.write(''.join(self._format(*record) + '\n' for record in records))
+                stream.flush()
+            except Exception:
+                pass
+            finally:
+                for _ in records:
+                    self._queue.task_done()
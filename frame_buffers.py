@@ -0,0 +1,103 @@
+"""
+映像フレームのバッファ管理
+キャプチャ先の配列はプールして使い回し、エンコード済みJPEGは
+multipartチャンクとして1フレームにつき1回だけ組み立てて全クライアントで共有する
+"""
+import threading
+
+import numpy as np
+
+MULTIPART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MULTIPART_TRAILER = b'\r\n'
+
+class EncodedFrame:
+    """
+    エンコード済みJPEG1枚分
+    chunkは /video_feed にそのまま書き込めるmultipartチャンク（変更不可のbytes）で、
+    JPEG本体はそのスライス（view）として参照するため、クライアント数によらずコピーは1回
+    """
+    __slots__ = ('chunk', 'size', '_jpeg')
+
+    def __init__(self, jpeg):
+        """jpeg: バッファプロトコルを持つJPEGデータ（cv2.imencodeの結果や共有メモリのmemoryview）"""
+        self.chunk = b''.join((MULTIPART_HEADER, jpeg, MULTIPART_TRAILER))
+        self.size = len(self.chunk) - len(MULTIPART_HEADER) - len(MULTIPART_TRAILER)
+        self._jpeg = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def view(self):
+        """JPEG本体のmemoryview（コピーなし）"""
+        start = len(MULTIPART_HEADER)
+        return memoryview(self.chunk)[start:start + self.size]
+
+    @property
+    def jpeg(self):
+        """JPEG本体のbytes（Socket.IOのバイナリ送信用、初回のみコピーして共有）"""
+        if self._jpeg is None:
+            self._jpeg = bytes(self.view)
+        return self._jpeg
+
+class PooledFrame:
+    """プールから貸し出されるキャプチャ用配列（参照がなくなるとプールに戻る）"""
+    __slots__ = ('array', '_pool', '_refs')
+
+    def __init__(self, pool, array):
+        self.array = array
+        self._pool = pool
+        self._refs = 0
+
+    def retain(self):
+        """参照を1つ増やす（エンコードステージに渡す前に呼ぶ）"""
+        with self._pool._lock:
+            self._refs += 1
+
+    def release(self):
+        """参照を1つ減らし、0になったらプールに戻す"""
+        with self._pool._lock:
+            self._refs -= 1
+            if self._refs == 0:
+                self._pool._free.append(self)
+
+class FramePool:
+    """
+    同じ形のキャプチャ用配列のプール
+    limitまでは必要に応じて確保し、それ以降は返却された配列を使い回す
+    """
+    def __init__(self, shape, dtype=np.uint8, limit=8):
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._free = []
+        self.allocated = 0
+        self.exhausted = 0  # 全ての配列が使用中で貸し出せなかった回数
+
+    def acquire(self):
+        """
+        空いている配列を借りる（呼び出し側が参照を1つ持った状態で返す）
+        return: PooledFrame、全て使用中でlimitに達している場合はNone
+        """
+        with self._lock:
+            if self._free:
+                frame = self._free.pop()
+            elif self.allocated < self.limit:
+                frame = PooledFrame(self, np.empty(self.shape, dtype=self.dtype))
+                self.allocated += 1
+            else:
+                self.exhausted += 1
+                return None
+            frame._refs = 1
+            return frame
+
+    def status(self):
+        """プールの使用状況"""
+        with self._lock:
+            return {
+                'allocated': self.allocated,
+                'free': len(self._free),
+                'limit': self.limit,
+                'exhausted': self.exhausted
+            }
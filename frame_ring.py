@@ -0,0 +1,150 @@
+"""
+共有メモリ上のJPEGフレームリングバッファ
+capture_daemon.py（書き込み側）とapp.py（読み出し側）がプロセスをまたいでフレームを共有する
+
+レイアウト:
+  ヘッダ: マジック, バージョン, スロット数, スロットサイズ, 最新シーケンス番号,
+          書き込み側の生存時刻, 読み出し側の最終読み出し時刻
+  スロット: シーケンス番号, データ長, キャプチャ時刻, JPEGデータ
+生存時刻・最終読み出し時刻は time.monotonic()（Linuxではシステム全体で共通なのでプロセス間で比較でき、
+壁時計と違いNTPの補正で飛ばない）、キャプチャ時刻は配信・録画で使うため time.time()
+書き込み中のスロットはシーケンス番号を0にしておき、読み出し側はコピーの前後で
+シーケンス番号が変わっていないことを確認する（seqlock）
+"""
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+RING_MAGIC = b'RPFR'
+RING_VERSION = 2
+RING_SLOTS = 8                 # スロット数
+RING_SLOT_SIZE = 512 * 1024    # 1スロットの最大JPEGサイズ（バイト）
+
+HEADER = struct.Struct('<4sIIIQdd')
+SLOT_HEADER = struct.Struct('<QId')
+WRITE_SEQUENCE_OFFSET = 16
+PRODUCER_HEARTBEAT_OFFSET = 24
+READER_HEARTBEAT_OFFSET = 32
+
+def ring_name(profile):
+    """レンディション名に対応する共有メモリ名"""
+    return f'rpicontest_frames_{profile}'
+
+class FrameRing:
+    """共有メモリのフレームリングバッファ（create で書き込み側、attach で読み出し側）"""
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        self._buf = shm.buf
+        _, _, self.slots, self.slot_size, _, _, _ = HEADER.unpack_from(self._buf, 0)
+        self.dropped = 0
+
+    @classmethod
+    def create(cls, name, slots=RING_SLOTS, slot_size=RING_SLOT_SIZE):
+        """リングを作成（同名の古いリングが残っていれば作り直す）"""
+        size = HEADER.size + slots * (SLOT_HEADER.size + slot_size)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        HEADER.pack_into(shm.buf, 0, RING_MAGIC, RING_VERSION, slots, slot_size, 0, time.monotonic(), 0.0)
+        for slot in range(slots):
+            SLOT_HEADER.pack_into(shm.buf, HEADER.size + slot * (SLOT_HEADER.size + slot_size), 0, 0, 0.0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """既存のリングに接続（見つからない場合はFileNotFoundError）"""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python 3.12以前: 読み出し側の終了時にリングが削除されないよう追跡を外す
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+
+        magic, version = struct.unpack_from('<4sI', shm.buf, 0)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            shm.close()
+            raise ValueError(f'フレームリングの形式が異なります: {name}')
+        return cls(shm, owner=False)
+
+    def _slot_offset(self, sequence):
+        return HEADER.size + (sequence % self.slots) * (SLOT_HEADER.size + self.slot_size)
+
+    @property
+    def sequence(self):
+        """最新のシーケンス番号"""
+        return struct.unpack_from('<Q', self._buf, WRITE_SEQUENCE_OFFSET)[0]
+
+    def write(self, frame, captured_at=None):
+        """
+        フレームを次のスロットに書き込む（書き込み側は1プロセス・1スレッドのみ）
+        return: 書き込んだ場合True、スロットに収まらず破棄した場合False
+        """
+        if len(frame) > self.slot_size:
+            self.dropped += 1
+            return False
+
+        sequence = self.sequence + 1
+        offset = self._slot_offset(sequence)
+        data_offset = offset + SLOT_HEADER.size
+        # 書き込み中はスロットを無効にしておく
+        SLOT_HEADER.pack_into(self._buf, offset, 0, 0, 0.0)
+        self._buf[data_offset:data_offset + len(frame)] = frame
+        SLOT_HEADER.pack_into(self._buf, offset, sequence, len(frame),
+                              captured_at if captured_at is not None else time.time())
+        struct.pack_into('<Qd', self._buf, WRITE_SEQUENCE_OFFSET, sequence, time.monotonic())
+        return True
+
+    def read_latest(self, last_sequence, wrap=bytes):
+        """
+        last_sequenceより新しい最新フレームを読み出す
+        wrap: スロットのmemoryviewからフレームを作る関数（ここでコピーする）
+        return: (シーケンス番号, フレーム, キャプチャ時刻)、新しいフレームがなければフレームがNone
+        """
+        sequence = self.sequence
+        if sequence <= last_sequence:
+            return last_sequence, None, None
+
+        offset = self._slot_offset(sequence)
+        slot_sequence, length, captured_at = SLOT_HEADER.unpack_from(self._buf, offset)
+        if slot_sequence != sequence or length > self.slot_size:
+            return last_sequence, None, None
+        data_offset = offset + SLOT_HEADER.size
+        frame = wrap(self._buf[data_offset:data_offset + length])
+        # コピー中に上書きされていないか確認
+        if struct.unpack_from('<Q', self._buf, offset)[0] != sequence:
+            return last_sequence, None, None
+        return sequence, frame, captured_at
+
+    def touch_reader(self):
+        """読み出し側が視聴中であることを書き込み側に知らせる"""
+        struct.pack_into('<d', self._buf, READER_HEARTBEAT_OFFSET, time.monotonic())
+
+    def touch_producer(self):
+        """書き込み側が動作中であることを知らせる"""
+        struct.pack_into('<d', self._buf, PRODUCER_HEARTBEAT_OFFSET, time.monotonic())
+
+    @property
+    def reader_heartbeat(self):
+        """読み出し側の最終読み出し時刻（time.monotonic()）"""
+        return struct.unpack_from('<d', self._buf, READER_HEARTBEAT_OFFSET)[0]
+
+    @property
+    def producer_heartbeat(self):
+        """書き込み側の最終更新時刻（time.monotonic()）"""
+        return struct.unpack_from('<d', self._buf, PRODUCER_HEARTBEAT_OFFSET)[0]
+
+    def close(self):
+        """リングから切断（作成側は共有メモリも削除）"""
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
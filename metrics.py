@@ -0,0 +1,205 @@
+"""
+Prometheusテキスト形式で出力する軽量なメトリクス
+外部ライブラリを使わず、カウンター・ゲージ・ヒストグラムと
+スクレイプ時に値を集めるコレクターだけを持つ
+registry.enabled をFalseにすると計測はすべて何もしない
+"""
+import bisect
+import threading
+import time
+
+class Metric:
+    """ラベルの組ごとに値を持つメトリクスの基底クラス"""
+    kind = 'untyped'
+
+    def __init__(self, registry, name, help_text):
+        self._registry = registry
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}  # ラベルのタプル -> 値
+
+    def set(self, value, **labels):
+        """値を直接設定する（コレクターが現在値を写すときにも使う）"""
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def clear(self):
+        """全てのラベルの値を消す（いなくなったクライアントの値を残さないため）"""
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self):
+        """(接尾辞, ラベルのdict, 値) を返す"""
+        with self._lock:
+            items = list(self._values.items())
+        return [('', dict(labels), value) for labels, value in items]
+
+class Counter(Metric):
+    """増えるだけの値"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not self._registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """任意に上下する値"""
+    kind = 'gauge'
+
+class Histogram(Metric):
+    """固定バケットのヒストグラム"""
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, buckets):
+        super().__init__(registry, name, help_text)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        if not self._registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # バケットごとの件数（最後は+Inf）, 合計, 件数
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def totals(self, **labels):
+        """(件数, 合計) を返す"""
+        with self._lock:
+            entry = self._values.get(tuple(sorted(labels.items())))
+            return (entry[2], entry[1]) if entry else (0, 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total, count)
+                     for labels, (counts, total, count) in self._values.items()]
+        samples = []
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + [float('inf')], counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(('_sum', dict(labels), total))
+            samples.append(('_count', dict(labels), count))
+        return samples
+
+class RateGauge:
+    """1秒ごとに区切って発生頻度（回/秒）を求めるゲージ"""
+    def __init__(self, gauge, window=1.0):
+        self._gauge = gauge
+        self._window = window
+        self._count = 0
+        self._started = time.monotonic()
+
+    def tick(self):
+        """1回分を数える"""
+        if not self._gauge._registry.enabled:
+            return
+        self._count += 1
+        now = time.monotonic()
+        elapsed = now - self._started
+        if elapsed >= self._window:
+            self._gauge.set(self._count / elapsed)
+            self._count = 0
+            self._started = now
+
+    def expire(self):
+        """窓の2倍以上数えられていなければ0にする（スクレイプ時に呼ぶ）"""
+        if time.monotonic() - self._started > 2 * self._window:
+            self._gauge.set(0.0)
+
+class TimedLock:
+    """
+    取得待ち時間をヒストグラムに記録するロックのラッパー
+    Conditionのロックとしても使えるよう、RLockの内部メソッドは元のロックに委ねる
+    """
+    def __init__(self, lock, histogram):
+        self._lock = lock
+        self._histogram = histogram
+        self._is_owned = lock._is_owned
+        self._release_save = lock._release_save
+        self._acquire_restore = lock._acquire_restore
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self._histogram._registry.enabled:
+            return self._lock.acquire(blocking, timeout)
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        self._histogram.observe(time.perf_counter() - started)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+class Registry:
+    """メトリクスの登録とテキスト形式での出力"""
+    def __init__(self, prefix, enabled=True):
+        self.prefix = prefix
+        self.enabled = enabled
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text):
+        return self._register(Counter(self, self.prefix + name, help_text))
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge(self, self.prefix + name, help_text))
+
+    def histogram(self, name, help_text, buckets):
+        return self._register(Histogram(self, self.prefix + name, help_text, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """スクレイプ時に呼ぶ関数を登録（登録済みのメトリクスに値を入れる）"""
+        self._collectors.append(collector)
+
+    def render(self):
+        """Prometheusテキスト形式（text/plain; version=0.0.4）"""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"メトリクス収集エラー: {e}")
+
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric._samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -36,6 +36,11 @@ socket.on('connect', function() {
     console.log('サーバーに接続しました');
     connectionStatus.className = 'connection-status connected';
     statusValue.textContent = 'サーバーに接続しました';
+    socket.emit('telemetry_subscribe');
+    // URLで ?video=socket が指定されているか、再接続時はSocket.IO映像を購読
+    if (socketVideo || new URLSearchParams(window.location.search).get('video') === 'socket') {
+        setSocketVideo(true);
+    }
 });
 
 socket.on('disconnect', function() {
@@ -44,54 +49,106 @@ socket.on('disconnect', function() {
     statusValue.textContent = 'サーバーから切断されました';
 });
 
-// ステータス更新
-socket.on('status', function(data) {
-    statusValue.textContent = `動作: ${data.action}, 速度: ${data.speed}%`;
+// 映像モード切替（HTTPストリーム / Socket.IOバイナリ配信）
+const videoStream = document.getElementById('videoStream');
+const videoModeBtn = document.getElementById('videoModeBtn');
+const videoLatency = document.getElementById('videoLatency');
+const videoFeedUrl = videoStream.getAttribute('src');
+const videoProfile = new URL(videoFeedUrl, window.location.href).searchParams.get('profile') || 'full';
+let socketVideo = false;
+let videoObjectUrl = null;
+
+function setSocketVideo(enabled) {
+    socketVideo = enabled;
+    videoModeBtn.classList.toggle('active', enabled);
+    if (enabled) {
+        // HTTPストリームを閉じてSocket.IO配信に切り替え
+        videoStream.removeAttribute('src');
+        socket.emit('video_subscribe', { profile: videoProfile });
+        videoModeBtn.textContent = 'HTTP映像に切替';
+    } else {
+        socket.emit('video_unsubscribe');
+        if (videoObjectUrl) {
+            URL.revokeObjectURL(videoObjectUrl);
+            videoObjectUrl = null;
+        }
+        videoStream.src = videoFeedUrl;
+        videoLatency.textContent = '';
+        videoModeBtn.textContent = 'Socket.IO映像に切替';
+    }
+}
+
+videoModeBtn.addEventListener('click', function() {
+    setSocketVideo(!socketVideo);
 });
 
-// エラーメッセージ
-socket.on('error', function(data) {
-    statusValue.textContent = `エラー: ${data.message}`;
-    statusValue.style.color = 'red';
-    setTimeout(() => {
-        statusValue.style.color = '#666';
-    }, 3000);
+// 録画の開始・停止（状態はテレメトリで全クライアントに反映される）
+const recordBtn = document.getElementById('recordBtn');
+recordBtn.addEventListener('click', function() {
+    socket.emit('recording_control', { action: robotState.recording ? 'stop' : 'start' });
+});
+
+socket.on('video_frame', function(data) {
+    if (!socketVideo) return;
+    
+    const url = URL.createObjectURL(new Blob([data.data], { type: 'image/jpeg' }));
+    videoStream.onload = function() {
+        // 表示できたらackを返す（サーバー側のフロー制御）
+        socket.emit('video_ack', { seq: data.seq });
+        // キャプチャから表示までの遅延（サーバーとの時計のずれを含む）
+        const latency = Date.now() - data.timestamp * 1000;
+        videoLatency.textContent = `遅延: ${Math.round(latency)}ms`;
+    };
+    if (videoObjectUrl) {
+        URL.revokeObjectURL(videoObjectUrl);
+    }
+    videoObjectUrl = url;
+    videoStream.src = url;
 });
 
-// サーボモーター状態更新
-socket.on('servo_status', function(data) {
-    if (data.type === 'pitch') {
-        pitchAngle.textContent = data.angle;
-        pitchSlider.value = data.angle;
-    } else if (data.type === 'yaw') {
-        yawAngle.textContent = data.angle;
-        yawSlider.value = data.angle;
-    } else if (data.pitch !== undefined && data.yaw !== undefined) {
-        // 初期状態の場合
+// テレメトリ（接続時・get_status時は全状態、以降は変更された項目だけが届く）
+const robotState = {};
+const LOCAL_INPUT_HOLD = 500; // 自分でスライダーを操作した直後はサーバーの値で上書きしない（ミリ秒）
+let pitchInputAt = 0;
+let yawInputAt = 0;
+let brightnessInputAt = 0;
+
+socket.on('telemetry', function(data) {
+    Object.assign(robotState, data);
+    const now = Date.now();
+    
+    if (!data.full && ('action' in data || 'speed' in data)) {
+        statusValue.textContent = `動作: ${robotState.action}, 速度: ${robotState.speed}%`;
+    }
+    if ('pitch' in data && now - pitchInputAt > LOCAL_INPUT_HOLD) {
         pitchAngle.textContent = data.pitch;
-        yawAngle.textContent = data.yaw;
         pitchSlider.value = data.pitch;
+    }
+    if ('yaw' in data && now - yawInputAt > LOCAL_INPUT_HOLD) {
+        yawAngle.textContent = data.yaw;
         yawSlider.value = data.yaw;
     }
+    if ('led_brightness' in data && now - brightnessInputAt > LOCAL_INPUT_HOLD) {
+        brightnessSlider.value = data.led_brightness;
+        brightnessValue.textContent = data.led_brightness;
+    }
+    if ('recording' in data) {
+        recordBtn.classList.toggle('recording', data.recording);
+    }
+    if ('led_colors' in data) {
+        ledIndicators.forEach((led, index) => {
+            led.style.backgroundColor = data.led_colors[index];
+        });
+    }
 });
 
-// LED状態更新
-socket.on('led_status', function(data) {
-    if (data.action === 'color_set' && data.led_index !== undefined) {
-        const color = `rgb(${data.r}, ${data.g}, ${data.b})`;
-        if (data.led_index === -1) {
-            // 全LED
-            ledIndicators.forEach(led => {
-                led.style.backgroundColor = color;
-            });
-        } else {
-            // 個別LED
-            const led = document.querySelector(`[data-led="${data.led_index}"]`);
-            if (led) {
-                led.style.backgroundColor = color;
-            }
-        }
-    }
+// エラーメッセージ
+socket.on('error', function(data) {
+    statusValue.textContent = `エラー: ${data.message}`;
+    statusValue.style.color = 'red';
+    setTimeout(() => {
+        statusValue.style.color = '#666';
+    }, 3000);
 });
 
 // 速度スライダーの更新
@@ -101,6 +158,7 @@ speedSlider.addEventListener('input', function() {
 
 // サーボスライダーの更新
 pitchSlider.addEventListener('input', function() {
+    pitchInputAt = Date.now();
     const angle = parseInt(this.value);
     pitchAngle.textContent = angle;
     socket.emit('servo_angle', {
@@ -110,6 +168,7 @@ pitchSlider.addEventListener('input', function() {
 });
 
 yawSlider.addEventListener('input', function() {
+    yawInputAt = Date.now();
     const angle = parseInt(this.value);
     yawAngle.textContent = angle;
     socket.emit('servo_angle', {
@@ -181,6 +240,7 @@ function updateColorPicker() {
 
 // 明度スライダー
 brightnessSlider.addEventListener('input', function() {
+    brightnessInputAt = Date.now();
     brightnessValue.textContent = this.value;
     socket.emit('led_control', {
         action: 'set_brightness',
@@ -474,6 +534,14 @@ document.addEventListener('keyup', function(event) {
     }
 });
 
+// デッドマン: 接続中は定期的にハートビートを送る（走行中に途絶えるとサーバーが自動停止）
+const HEARTBEAT_INTERVAL = 250; // ミリ秒
+setInterval(function() {
+    if (socket.connected) {
+        socket.emit('heartbeat');
+    }
+}, HEARTBEAT_INTERVAL);
+
 // ページロード時にステータスを取得
 window.addEventListener('load', function() {
     socket.emit('get_status');
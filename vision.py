@@ -0,0 +1,244 @@
+"""
+キャプチャしたフレームを解析するプロセッサー（プラグイン）の実行段
+キャプチャ経路では縮小コピーを作ってワーカーに渡すだけで、解析はプロセッサーごとの専用スレッドで行う
+（ワーカーが処理中のフレームは待たずに飛ばすため、解析が遅れても映像配信は止まらない）
+
+プロセッサーは FrameProcessor を継承して process() を実装し、VisionStage.add() で登録する
+"""
+import threading
+import time
+
+import numpy as np
+
+class FrameProcessor:
+    """
+    フレームプロセッサーの基底クラス
+    every: N枚に1枚だけ処理する
+    budget: 1回の処理時間の目安（秒）、超えた場合はVisionStageが超過として報告する
+    """
+    name = 'processor'
+    # 数値の設定の範囲（両端を含む）
+    limits = {'every': (1, 10000), 'budget': (0.001, 10.0)}
+
+    def __init__(self, every=1, budget=0.02, enabled=True):
+        self.every = max(1, every)
+        self.budget = budget
+        self.enabled = enabled
+
+    def process(self, frame, captured_at):
+        """
+        縮小済みのフレーム（BGR、読み取り専用として扱う）を解析する
+        return: Socket.IOで送る結果のdict（送るものがなければNone）
+        """
+        raise NotImplementedError
+
+    def configure(self, **options):
+        """設定を変更する（未知の項目・不正な値はValueErrorで、その場合は何も変更しない）"""
+        current = self.options()
+        values = {}
+        for key, value in options.items():
+            if key not in current:
+                raise ValueError(f'未知の設定: {key}')
+            # 真偽値は真偽値だけ、数値は数値だけを受け付けて現在値と同じ型にそろえる
+            # （bool('false')はTrueになるため文字列などは変換しない）
+            kind = type(current[key])
+            if kind is bool:
+                if not isinstance(value, bool):
+                    raise ValueError(f'{key}はtrue/falseで指定してください: {value!r}')
+            elif kind in (int, float):
+                low, high = self.limits.get(key, (float('-inf'), float('inf')))
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+                    raise ValueError(f'{key}が不正です: {value!r}（{low}〜{high}の数値）')
+                if kind is int and value != int(value):
+                    raise ValueError(f'{key}は整数で指定してください: {value!r}')
+                value = kind(value)
+            values[key] = value
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def options(self):
+        """vision_controlで変更できる設定と現在値"""
+        return {'enabled': self.enabled, 'every': self.every, 'budget': self.budget}
+
+class ColorBlobTracker(FrameProcessor):
+    """
+    指定した色範囲の画素の塊を追跡する
+    lower/upperはRGBの範囲（両端を含む）、該当画素の重心と外接矩形を返す
+    位置は画面中央を0とし左上が(-1, -1)、右下が(1, 1)
+    on_target: 見つかったときに (x, y) で呼ぶ関数（auto_aimがTrueの場合のみ、サーボの追従用）
+    """
+    name = 'color_blob'
+    limits = dict(FrameProcessor.limits, min_area=(0.0, 1.0))
+
+    def __init__(self, lower=(150, 0, 0), upper=(255, 90, 90), min_area=0.002,
+                 on_target=None, auto_aim=False, **kwargs):
+        super().__init__(**kwargs)
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+        self.min_area = min_area
+        self.auto_aim = auto_aim
+        self._on_target = on_target
+
+    def process(self, frame, captured_at):
+        height, width = frame.shape[:2]
+        # フレームはBGRの順なので範囲を並べ替え、チャンネルごとに全画素を一度に比較してマスクに積む
+        # （3次元のまま比較してall(axis=2)するより一時配列が少なく速い）
+        lower, upper = self.lower[::-1], self.upper[::-1]
+        mask = frame[..., 0] >= lower[0]
+        mask &= frame[..., 0] <= upper[0]
+        for channel in (1, 2):
+            plane = frame[..., channel]
+            mask &= plane >= lower[channel]
+            mask &= plane <= upper[channel]
+
+        # 行・列ごとの画素数から面積・重心・外接矩形を求める
+        columns = np.count_nonzero(mask, axis=0)
+        rows = np.count_nonzero(mask, axis=1)
+        area = int(columns.sum())
+        result = {'found': False, 'area': round(area / mask.size, 4)}
+        if area == 0 or area / mask.size < self.min_area:
+            return result
+
+        cx = float(columns @ np.arange(width)) / area
+        cy = float(rows @ np.arange(height)) / area
+        xs = np.flatnonzero(columns)
+        ys = np.flatnonzero(rows)
+        result.update(
+            found=True,
+            x=round(cx / (width - 1) * 2 - 1, 4) if width > 1 else 0.0,
+            y=round(cy / (height - 1) * 2 - 1, 4) if height > 1 else 0.0,
+            bbox=[round(float(xs[0]) / width, 4), round(float(ys[0]) / height, 4),
+                  round(float(xs[-1] + 1) / width, 4), round(float(ys[-1] + 1) / height, 4)]
+        )
+        if self.auto_aim and self._on_target is not None:
+            self._on_target(result['x'], result['y'])
+        return result
+
+    def configure(self, **options):
+        for key in ('lower', 'upper'):
+            if key in options:
+                value = options[key]
+                if (not isinstance(value, (list, tuple)) or len(value) != 3
+                        or not all(isinstance(v, int) and not isinstance(v, bool) and 0 <= v <= 255
+                                   for v in value)):
+                    raise ValueError(f'{key}はRGBの3要素（0-255の整数）で指定してください')
+                options[key] = tuple(value)
+        super().configure(**options)
+
+    def options(self):
+        return dict(super().options(), lower=list(self.lower), upper=list(self.upper),
+                    min_area=self.min_area, auto_aim=self.auto_aim)
+
+class ProcessorWorker:
+    """プロセッサー1つ分のワーカー（最新の1フレームだけを保持し、処理中に届いたフレームは置き換える）"""
+    def __init__(self, processor, stage):
+        self.processor = processor
+        self._stage = stage
+        self._condition = threading.Condition()
+        self._pending = None
+        self._busy = False
+        self.frames_processed = 0
+        self.frames_skipped = 0   # 前のフレームを処理中だったため飛ばした数
+        self.overruns = 0
+        self.last_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_seconds = 0.0
+        threading.Thread(target=self._run, daemon=True, name=f'vision-{processor.name}').start()
+
+    def offer(self, frame, captured_at):
+        """フレームを渡す（ブロックしない）"""
+        with self._condition:
+            if self._busy or self._pending is not None:
+                self.frames_skipped += 1
+            self._pending = (frame, captured_at)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+                frame, captured_at = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                started = time.perf_counter()
+                result = self._stage.run(self.processor.process, frame, captured_at)
+                seconds = time.perf_counter() - started
+                self.frames_processed += 1
+                self.last_seconds = seconds
+                self.max_seconds = max(self.max_seconds, seconds)
+                self.total_seconds += seconds
+                if seconds > self.processor.budget:
+                    self.overruns += 1
+                    self._stage.on_overrun(self.processor, seconds)
+                self._stage.on_result(self.processor, result, captured_at, seconds)
+            except Exception as e:
+                print(f"フレーム解析エラー ({self.processor.name}): {e}")
+            finally:
+                with self._condition:
+                    self._busy = False
+
+    def status(self):
+        processed = self.frames_processed
+        return dict(
+            self.processor.options(),
+            frames_processed=processed,
+            frames_skipped=self.frames_skipped,
+            overruns=self.overruns,
+            last_ms=round(self.last_seconds * 1000, 3),
+            avg_ms=round(self.total_seconds / processed * 1000, 3) if processed else 0.0,
+            max_ms=round(self.max_seconds * 1000, 3)
+        )
+
+class VisionStage:
+    """
+    キャプチャ経路から呼ばれる解析段
+    scale: 縦横をこの間隔で間引いた縮小コピーをプロセッサーに渡す
+    on_result(processor, result, captured_at, seconds): 処理が終わるたびにワーカースレッドから呼ばれる
+    on_overrun(processor, seconds): 処理時間がプロセッサーのbudgetを超えたときに呼ばれる
+    run(function, *args): 処理の実行方法（geventではOSスレッドで実行する関数を渡す）
+    """
+    def __init__(self, scale=4, on_result=None, on_overrun=None, run=None):
+        self.scale = max(1, scale)
+        self.on_result = on_result or (lambda processor, result, captured_at, seconds: None)
+        self.on_overrun = on_overrun or (lambda processor, seconds: None)
+        self.run = run or (lambda function, *args: function(*args))
+        self._workers = {}
+        self._frame_count = 0
+
+    def add(self, processor):
+        """プロセッサーを登録する"""
+        self._workers[processor.name] = ProcessorWorker(processor, self)
+        return processor
+
+    def get(self, name):
+        worker = self._workers.get(name)
+        return worker.processor if worker else None
+
+    @property
+    def active(self):
+        """有効なプロセッサーがあるか（ある間は視聴者がいなくてもキャプチャを続ける）"""
+        return any(worker.processor.enabled for worker in self._workers.values())
+
+    def submit(self, frame, captured_at):
+        """
+        キャプチャしたフレームを渡す（キャプチャスレッドから呼ぶ）
+        処理対象のプロセッサーがあるときだけ縮小コピーを1枚作って共有する
+        （元のフレームはプールに戻って上書きされるためコピーが必要）
+        """
+        self._frame_count += 1
+        due = [worker for worker in self._workers.values()
+               if worker.processor.enabled and self._frame_count % worker.processor.every == 0]
+        if not due:
+            return
+        small = np.ascontiguousarray(frame[::self.scale, ::self.scale])
+        small.flags.writeable = False  # 複数のプロセッサーで共有する
+        for worker in due:
+            worker.offer(small, captured_at)
+
+    def status(self):
+        return {
+            'scale': self.scale,
+            'frames': self._frame_count,
+            'processors': {name: worker.status() for name, worker in self._workers.items()}
+        }